@@ -0,0 +1,74 @@
+"""Benchmark the compressor engines
+
+Times the legacy effects.compressor against dynamics.compress with peak and
+RMS detection, lookahead, and the pure Python gain smoothing used when numba
+is not installed. Every case runs in a fresh process on stereo noise with a
+gated level, so the compressor has to attack and release.
+
+Usage:
+    python benchmarks/bench_compressor.py --out results.json
+    python benchmarks/bench_compressor.py --seconds 300
+    python benchmarks/bench_compressor.py --compare old.json new.json
+"""
+import argparse
+
+import numpy as np
+
+from common import SR, time_case, run_isolated, save_results, print_results, compare
+
+CASES = [
+    ('legacy', {}),
+    ('compress', {'detector': 'peak'}),
+    ('compress', {'detector': 'rms'}),
+    ('compress', {'detector': 'peak', 'knee': 6, 'lookahead': 0.005}),
+    ('compress_python', {'detector': 'peak'}),
+]
+
+def run_case(stage: str, params: dict, seconds: float, repeat: int) -> dict:
+    from pysampler import effects, dynamics
+    n_frames = int(SR * seconds)
+
+    if stage == 'compress_python':
+        # Same engine without numba
+        dynamics.smooth_gain = dynamics._smooth_gain_python
+
+    funcs = {
+        'legacy': lambda audio: effects.compressor(audio, -12, 4, 0.01, 0.1),
+        'compress': lambda audio: dynamics.compress(audio, SR, -12, 4, 0.01, 0.1, **params),
+        'compress_python': lambda audio: dynamics.compress(audio, SR, -12, 4, 0.01, 0.1, **params),
+    }
+
+    def setup():
+        rng = np.random.default_rng(0)
+        # Noise switching between loud and quiet every half second
+        level = np.where(np.arange(n_frames) % SR < SR // 2, 1.0, 0.1)[:, np.newaxis]
+        audio = rng.uniform(-1, 1, (n_frames, 2)) * level
+        # Keep numba compilation out of the timings
+        funcs[stage](audio[:SR])
+        return audio
+
+    result = time_case(setup, funcs[stage], n_frames, repeat)
+    result.update(stage=stage, params=params)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench_compressor.json', help='Path of the JSON results')
+    parser.add_argument('--seconds', type=float, default=60, help='Length of the processed audio')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the best is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for stage, params in CASES:
+        result = run_isolated(run_case, stage, params, args.seconds, args.repeat)
+        print_results([result])
+        results.append(result)
+    save_results(args.out, 'compressor', results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Check that renders which should agree do
+
+Renders the same sequence through paths which must give identical output
+(render and render_stream at several block sizes), and checks that the
+render cache fingerprint changes with the output (eg. when swapping the
+names of tracks keying a sidechain).
+Exits with status 1 if any check fails.
+
+Usage:
+    python benchmarks/bench_consistency.py
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+from common import make_samples, build_sequence
+
+BLOCK_SIZES = [64, 1000, 65536]
+
+def lookahead_tails(samples: dict) -> 'pysampler.Sequencer':
+    """Tracks ringing past the end (high pass filters) into a lookahead master limiter"""
+    from pysampler.effects import Filter, Limiter
+    seq = build_sequence(samples, n_tracks=4, n_steps=32)
+    for track in seq.tracks:
+        track.add_effect(Filter('high', 250, 2))
+    seq.add_effect(Limiter(-1))
+    return seq
+
+def check_name_swap(samples: dict) -> bool:
+    """Swapping the names of two tracks moves a sidechain key, so it must change the fingerprint"""
+    from pysampler.effects import Dynamics
+    seq = build_sequence(samples, n_tracks=3, n_steps=32)
+    seq.tracks[2].add_effect(Dynamics(-30, 8, sidechain='track0'))
+    before = seq.fingerprint()
+    seq.tracks[0].name, seq.tracks[1].name = seq.tracks[1].name, seq.tracks[0].name
+    ok = seq.fingerprint() != before
+    print(f'{"name_swap fingerprint changes":<70} {"ok" if ok else "FAILED"}')
+    return ok
+
+def check_stream(name: str, build, samples: dict, tmp: str) -> bool:
+    """render and render_stream write the same file, whatever the block size"""
+    path = os.path.join(tmp, f'{name}.wav')
+    build(samples).render(path, normalize_output=False, verbose=False)
+    reference = sf.read(path)[0]
+    ok = True
+    for block_size in BLOCK_SIZES:
+        build(samples).render_stream(path, normalize_output=False, verbose=False, block_size=block_size)
+        stream = sf.read(path)[0]
+        error = float(np.max(np.abs(stream - reference))) if stream.shape == reference.shape else float('inf')
+        print(f'{name + " block_size=" + str(block_size):<70} max error {error:.3g} ({"ok" if error == 0 else "FAILED"})')
+        ok = ok and error == 0
+    return ok
+
+def main():
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = make_samples(os.path.join(tmp, 'samples'))
+        ok = check_stream('lookahead_tails', lookahead_tails, samples, tmp) and ok
+        ok = check_name_swap(samples) and ok
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark the startup time of import pysampler
+
+Every case imports in a fresh interpreter, so nothing is cached in
+sys.modules. 'import' is import pysampler alone, the other stages import
+the module which loads a heavy dependency on first use. Fails when
+import pysampler loads one of the heavy dependencies, so they stay lazy.
+
+Usage:
+    python benchmarks/bench_import.py --out results.json
+    python benchmarks/bench_import.py --repeat 10
+    python benchmarks/bench_import.py --compare old.json new.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from common import save_results, print_results, compare
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only loaded by pitch_resample, filters, VST effects, export_midi, verbose output and numba kernels
+HEAVY_MODULES = ['scipy.signal', 'librosa', 'pedalboard', 'mido', 'colorama', 'numba']
+
+CASES = [
+    ('import', {'module': 'pysampler'}),
+    ('first_use', {'module': 'scipy.signal'}),
+    ('first_use', {'module': 'librosa'}),
+    ('first_use', {'module': 'numba'}),
+]
+
+CHILD = """
+import sys, time, json, resource
+start = time.perf_counter()
+import pysampler
+{first_use}
+wall = time.perf_counter() - start
+print(json.dumps({{
+    'wall': wall,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'loaded': [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+def run_case(stage: str, params: dict) -> dict:
+    first_use = f'import {params["module"]}' if stage == 'first_use' else ''
+    code = CHILD.format(first_use=first_use, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result.update(stage=stage, params=params, samples_per_sec=0)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench_import.json', help='Path of the JSON results')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per case, the best is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for stage, params in CASES:
+        try:
+            runs = [run_case(stage, params) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print(f'{stage} {params["module"]}: not installed, skipped')
+            continue
+        result = min(runs, key=lambda run: run['wall'])
+        print_results([result])
+        results.append(result)
+    save_results(args.out, 'import', results)
+
+    loaded = results[0]['loaded']
+    if loaded:
+        print(f'import pysampler loaded {", ".join(loaded)}, import them on first use instead')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark the event mixing kernel on dense grids
+
+Mixes hi-hat rolls at 1/16, 1/32 and 1/64 with random velocities, and a
+polyphonic pad retriggered on every step so thousands of events overlap.
+'kernel' is Layer.mix with the compiled scatter-add loop (numba), 'numpy'
+scales every event into a reused scratch buffer (used without numba), and
+'per_event_copy' is the previous loop, which allocated a scaled copy of
+every event. Reports wall time, events/sec and the peak traced allocation
+of one mix.
+
+Usage:
+    python benchmarks/bench_mixing.py --out results.json
+    python benchmarks/bench_mixing.py --bars 64
+    python benchmarks/bench_mixing.py --compare old.json new.json
+"""
+import os
+import tempfile
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from common import SR, make_samples, time_case, run_isolated, save_results, print_results, compare
+
+GRIDS = [
+    {'grid': 1/16, 'sample': 'hihat'},
+    {'grid': 1/32, 'sample': 'hihat'},
+    {'grid': 1/64, 'sample': 'hihat'},
+    {'grid': 1/64, 'sample': 'hihat', 'monophonic': True},
+    {'grid': 1/32, 'sample': 'pad'},
+]
+
+CASES = [(stage, params) for stage in ('kernel', 'numpy', 'per_event_copy') for params in GRIDS]
+
+def per_event_copy(layer, canvas, offset, indices):
+    """Layer._mix_events before the scratch buffer, scaling a new copy of every event"""
+    end = offset + canvas.shape[0]
+    onsets = layer.events.onset
+    for i in indices:
+        onset = onsets[i]
+        length = layer.lengths[i]
+        data = layer.buffers[layer.buffer_index[i]]
+        src_start = max(offset, 0, onset) - onset
+        src_end = min(end, onset + length) - onset
+        dst_start = onset + src_start - offset
+        dst_end = onset + src_end - offset
+        piece = data[src_start : src_end] * layer.gains[i]
+        if layer.monophonic:
+            fade = min(layer.fade_len, length)
+            fade_start = max(src_start, length - fade)
+            if src_end > fade_start:
+                ramp = np.linspace(1.0, 0.0, fade)[fade_start - (length - fade) : src_end - (length - fade)]
+                piece[fade_start - src_start:] *= ramp[:, np.newaxis]
+            canvas[dst_start : dst_end] = piece
+        else:
+            canvas[dst_start : dst_end] += piece
+    return canvas
+
+def run_case(stage: str, params: dict, sample_dir: str, bars: int, repeat: int) -> dict:
+    import pysampler
+    from pysampler import mixer
+    from pysampler.mixer import Layer
+
+    if stage != 'kernel':
+        mixer.mix_kernel = None
+
+    samples = make_samples(sample_dir)
+    n_steps = int(bars / params['grid'])
+    rng = np.random.default_rng(0)
+    seq = pysampler.Sequencer(bpm=120, grid=params['grid'])
+    seq.add_track(
+        name = 'roll',
+        step_seq = [1] * n_steps,
+        vel_seq = rng.integers(40, 128, n_steps).tolist(),
+        sample = samples[params['sample']],
+        monophonic = params.get('monophonic', False)
+    )
+    events, seq_len_samples = seq.compile_events(SR)
+    track = seq.tracks[0]
+
+    def setup():
+        layer = Layer(events[0], track.samples[0], seq.resample_cache, track.monophonic, seq_len_samples, SR)
+        if stage == 'per_event_copy':
+            layer._mix_events = lambda canvas, offset, indices: per_event_copy(layer, canvas, offset, indices)
+        canvas = np.zeros((seq_len_samples, 2))
+        layer.mix(canvas) # Warm up scratch buffers and numba compilation
+        return layer, canvas
+
+    def run(arg):
+        layer, canvas = arg
+        canvas[:] = 0
+        layer.mix(canvas)
+
+    result = time_case(setup, run, seq_len_samples, repeat)
+
+    # Peak allocation of one mix, on top of the canvas
+    arg = setup()
+    tracemalloc.start()
+    run(arg)
+    alloc_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result.update(
+        stage=stage,
+        params=params,
+        events=len(events[0]),
+        events_per_sec=len(events[0]) / result['wall'],
+        alloc_peak_mb=alloc_peak / 1024 ** 2
+    )
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench_mixing.json', help='Path of the JSON results')
+    parser.add_argument('--bars', type=int, default=32, help='Length of the rolls in bars')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the best is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_dir = os.path.join(tmp, 'samples')
+        for stage, params in CASES:
+            result = run_isolated(run_case, stage, params, sample_dir, args.bars, args.repeat)
+            print_results([result])
+            print(f'{"":<70} {result["events"]} events, {result["events_per_sec"]:,.0f} events/sec, alloc peak {result["alloc_peak_mb"]:.2f} MB')
+            results.append(result)
+    save_results(args.out, 'mixing', results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Compare float32 renders with float64 renders
+
+Renders the same sequences in both precisions and checks that the largest
+difference stays below --max-error (default -100 dBFS, a few 24 bit steps).
+Also reports the wall time and peak RSS of each precision.
+Exits with status 1 if any case exceeds the bound.
+
+Usage:
+    python benchmarks/bench_precision.py
+    python benchmarks/bench_precision.py --quick --max-error -110
+"""
+import os
+import sys
+import math
+import tempfile
+import argparse
+
+import numpy as np
+
+from common import SR, make_samples, build_sequence, time_case, run_isolated, save_results, print_results
+
+CASES = [
+    {'n_tracks': 4, 'n_steps': 64, 'pitch_density': 0.0, 'effects': 'none'},
+    {'n_tracks': 4, 'n_steps': 64, 'pitch_density': 1.0, 'effects': 'none'},
+    {'n_tracks': 4, 'n_steps': 64, 'pitch_density': 0.5, 'effects': 'filter'},
+    {'n_tracks': 4, 'n_steps': 64, 'pitch_density': 0.5, 'effects': 'compressor'},
+    {'n_tracks': 4, 'n_steps': 64, 'pitch_density': 0.5, 'effects': 'full'},
+    {'n_tracks': 16, 'n_steps': 256, 'pitch_density': 0.5, 'effects': 'full'},
+]
+
+QUICK_CASES = CASES[:2] + CASES[4:5]
+
+def render_case(stage: str, params: dict, sample_dir: str, repeat: int) -> dict:
+    """Time render_array in one precision, returning the mix along with the timings"""
+    samples = make_samples(sample_dir)
+    dtype = np.float32 if stage == 'float32' else np.float64
+    mix = None
+
+    def setup():
+        seq = build_sequence(samples, dtype=dtype, **params)
+        seq.render_array() # Warm up the sample pool and resample cache
+        return seq
+
+    def run(seq):
+        nonlocal mix
+        mix = seq.render_array()
+
+    seq = build_sequence(samples, **params)
+    n_frames = int(len(seq.tracks[0].steps) * SR / (seq.bpm / 60) * seq.grid * 4)
+    result = time_case(setup, run, n_frames, repeat)
+    result.update(stage=stage, params=params, mix=mix)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench_precision.json', help='Path of the JSON results')
+    parser.add_argument('--quick', action='store_true', help='Run fewer cases')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the best is kept')
+    parser.add_argument('--max-error', type=float, default=-100, help='Largest allowed difference in dBFS')
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_dir = os.path.join(tmp, 'samples')
+        for params in QUICK_CASES if args.quick else CASES:
+            reference = run_isolated(render_case, 'float64', params, sample_dir, args.repeat)
+            single = run_isolated(render_case, 'float32', params, sample_dir, args.repeat)
+            error = float(np.max(np.abs(single.pop('mix') - reference.pop('mix'))))
+            error_db = 20 * math.log10(error) if error > 0 else float('-inf')
+            single['max_error_db'] = error_db
+            print_results([reference, single])
+            print(f'{"":<70} max error {error_db:.1f} dBFS ({"ok" if error_db <= args.max_error else "FAILED"})')
+            failed = failed or error_db > args.max_error
+            results += [reference, single]
+    save_results(args.out, 'precision', results)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
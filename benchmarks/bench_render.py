@@ -0,0 +1,146 @@
+"""Benchmark the render pipeline with synthetic samples
+
+Sweeps track count, step count, layer count, pitch density, effect chains
+and repeated bars (pattern_steps) around a default sequence, and times the
+DSP functions on their own.
+Every case runs in a fresh process and reports wall time, samples/sec and peak RSS.
+
+Usage:
+    python benchmarks/bench_render.py --out results.json
+    python benchmarks/bench_render.py --quick
+    python benchmarks/bench_render.py --compare old.json new.json
+"""
+import os
+import tempfile
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from common import (
+    SR, make_samples, build_sequence, time_case, run_isolated,
+    save_results, print_results, compare
+)
+
+DEFAULTS = {'n_tracks': 4, 'n_steps': 64, 'n_layers': 1, 'pitch_density': 0.0, 'effects': 'none'}
+
+SWEEPS = {
+    'n_tracks': [1, 4, 16],
+    'n_steps': [16, 64, 256],
+    'n_layers': [1, 2, 4],
+    'pitch_density': [0.0, 0.5, 1.0],
+    'effects': ['none', 'filter', 'compressor', 'clip', 'full'],
+    'pattern_steps': [16],
+}
+
+QUICK_SWEEPS = {
+    'n_tracks': [1, 4],
+    'pitch_density': [0.0, 1.0],
+    'effects': ['none', 'full'],
+}
+
+DSP_SECONDS = 10
+
+def run_render_case(stage: str, params: dict, sample_dir: str, out_dir: str, repeat: int) -> dict:
+    """Time Sequencer.render or Sequencer.render_stream for one parameter set"""
+    samples = make_samples(sample_dir)
+    filename = os.path.join(out_dir, f'{stage}.wav')
+
+    def setup():
+        seq = build_sequence(samples, **params)
+        # Warm up the sample pool and resample cache, as a long running process would
+        seq.render(filename, verbose=False)
+        return seq
+
+    def run(seq):
+        if stage == 'render_stream':
+            seq.render_stream(filename, verbose=False)
+        else:
+            seq.render(filename, verbose=False)
+
+    seq = build_sequence(samples, **params)
+    n_frames = int(len(seq.tracks[0].steps) * SR / (seq.bpm / 60) * seq.grid * 4)
+    result = time_case(setup, run, n_frames, repeat)
+    result.update(stage=stage, params=params)
+    return result
+
+def run_dsp_case(stage: str, params: dict, sample_dir: str, out_dir: str, repeat: int) -> dict:
+    """Time a single DSP function on DSP_SECONDS of stereo noise, and measure its peak allocation"""
+    from pysampler import effects
+    n_frames = SR * DSP_SECONDS
+    chain = [effects.Gain(6), effects.SoftClip(-6), effects.HardClip(-1), effects.Normalize(-1), effects.Gain(-3)]
+
+    def unfused(audio):
+        for effect in chain:
+            audio = effect.process(audio, SR)
+        return audio
+
+    funcs = {
+        'pitch_resample': lambda audio: effects.pitch_resample(audio, params.get('n', 2), SR),
+        'compressor': lambda audio: effects.compressor(audio, -12, 4, 0.01, 0.1),
+        'butterworth_filter': lambda audio: effects.butterworth_filter(audio, 'band', [100, 5000], params.get('order', 4)),
+        'effect_chain': lambda audio: effects.EffectChain(chain).process(audio, SR) if params.get('fused') else unfused(audio),
+    }
+
+    def setup():
+        audio = np.random.default_rng(0).uniform(-1, 1, (n_frames, 2))
+        # Keep lazy imports and first call setup out of the timings
+        funcs[stage](audio[:SR])
+        return audio
+
+    result = time_case(setup, funcs[stage], n_frames, repeat)
+
+    audio = setup()
+    tracemalloc.start()
+    funcs[stage](audio)
+    result['alloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+
+    result.update(stage=stage, params=params)
+    return result
+
+def cases(quick: bool = False) -> list[tuple]:
+    """Returns (function, stage, params) for every case"""
+    sweeps = QUICK_SWEEPS if quick else SWEEPS
+    render_params = []
+    for name, values in sweeps.items():
+        for value in values:
+            params = dict(DEFAULTS, **{name: value})
+            if params not in render_params:
+                render_params.append(params)
+
+    all_cases = [(run_render_case, 'render', params) for params in render_params]
+    all_cases.append((run_render_case, 'render_stream', dict(DEFAULTS, n_steps=256)))
+    all_cases += [
+        (run_dsp_case, 'pitch_resample', {'n': 2}),
+        (run_dsp_case, 'pitch_resample', {'n': -7}),
+        (run_dsp_case, 'compressor', {}),
+        (run_dsp_case, 'butterworth_filter', {'order': 4}),
+        (run_dsp_case, 'effect_chain', {'fused': False}),
+        (run_dsp_case, 'effect_chain', {'fused': True}),
+    ]
+    return all_cases
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='bench_render.json', help='Path of the JSON results')
+    parser.add_argument('--quick', action='store_true', help='Run a reduced sweep')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, the best is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_dir = os.path.join(tmp, 'samples')
+        for func, stage, params in cases(args.quick):
+            result = run_isolated(func, stage, params, sample_dir, tmp, args.repeat)
+            print_results([result])
+            results.append(result)
+    save_results(args.out, 'render', results)
+
+if __name__ == '__main__':
+    main()
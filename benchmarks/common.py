@@ -0,0 +1,192 @@
+"""Shared helpers for the benchmark scripts
+
+Benchmarks are self-contained: samples are generated with pysampler.synth.Synth,
+and each case runs in a fresh process so its peak RSS can be measured.
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import random
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+import numpy as np
+import soundfile as sf
+
+import pysampler
+from pysampler.synth import Synth
+
+SR = 44100
+
+def make_samples(folder: str, sr: int = SR) -> dict[str, str]:
+    """Write a small synthetic drum kit to folder, returns paths by name"""
+    os.makedirs(folder, exist_ok=True)
+    synth = Synth()
+    rng = np.random.default_rng(0)
+    np.random.seed(0) # Synth noise, so every process writes the same kit
+
+    def decay(length, rate):
+        return np.exp(-np.arange(length) / (sr * rate))[:, np.newaxis]
+
+    samples = {
+        # Low sine with a fast decay
+        'kick': synth.sine(length=int(sr * 0.4), cycle=sr / (2 * np.pi * 55)) * decay(int(sr * 0.4), 0.08),
+        # Mono noise burst
+        'snare': synth.noise(length=int(sr * 0.25)) * decay(int(sr * 0.25), 0.05),
+        # Short stereo noise
+        'hihat': synth.noise(length=int(sr * 0.08), stereo=True) * decay(int(sr * 0.08), 0.02),
+        # Long tone, mono
+        'pad': synth.sine(length=int(sr * 2), cycle=sr / (2 * np.pi * 220))[:, 0] * rng.uniform(0.9, 1.0),
+    }
+    paths = {}
+    for name, data in samples.items():
+        paths[name] = os.path.join(folder, f'{name}.wav')
+        sf.write(paths[name], data, sr)
+    return paths
+
+def build_sequence(
+        samples: dict[str, str],
+        n_tracks: int = 4,
+        n_steps: int = 64,
+        n_layers: int = 1,
+        pitch_density: float = 0.0,
+        effects: str = 'none',
+        pattern_steps: int = 0,
+        seed: int = 0,
+        dtype = np.float64
+    ) -> pysampler.Sequencer:
+    """Build a reproducible random sequence
+
+    Args:
+        samples (dict): Sample paths from make_samples
+        n_tracks (int): Number of tracks
+        n_steps (int): Number of steps per track
+        n_layers (int): Number of samples per track
+        pitch_density (float): Share of steps with a non-zero pitch (0..1)
+        effects (str): Track effect chain name, see make_effects
+        pattern_steps (int): Repeat a random pattern of this many steps, 0 for random steps throughout
+        seed (int): Random seed
+        dtype: Render precision, np.float64 or np.float32
+    """
+    random.seed(seed)
+    paths = list(samples.values())
+    seq = pysampler.Sequencer(bpm=120, grid=1/16, dtype=dtype)
+    for t in range(n_tracks):
+        n_random = pattern_steps or n_steps
+        gates = [1] + [int(random.random() < 0.5) for _ in range(n_random - 1)]
+        pitches = [random.choice([-7, -5, -2, 2, 5, 7]) if random.random() < pitch_density else 0 for _ in range(n_random)]
+        if pattern_steps:
+            gates = (gates * (n_steps // pattern_steps + 1))[:n_steps]
+            pitches = (pitches * (n_steps // pattern_steps + 1))[:n_steps]
+        seq.add_track(
+            name = f'track{t}',
+            step_seq = gates,
+            pitch_seq = pitches,
+            samples = [{'path': paths[(t + l) % len(paths)]} for l in range(n_layers)]
+        )
+        for effect in make_effects(effects):
+            seq.tracks[-1].add_effect(effect)
+    return seq
+
+def make_effects(chain: str) -> list:
+    """Track effect chains by name: 'none', 'filter', 'compressor', 'clip', 'full'"""
+    from pysampler import effects
+    chains = {
+        'none': [],
+        'filter': [effects.Filter('band', [100, 5000], 4)],
+        'compressor': [effects.Compressor(-12, 4, 0.01, 0.1, 0)],
+        'clip': [effects.Gain(6), effects.SoftClip(-6), effects.HardClip(-1)],
+    }
+    chains['full'] = chains['filter'] + chains['compressor'] + chains['clip']
+    return chains[chain]
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process (Linux reports KB, macOS bytes)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if platform.system() == 'Darwin' else rss / 1024
+
+def time_case(setup, run, n_frames, repeat: int = 3) -> dict:
+    """Run setup once, then run() repeat times, reporting the best wall time
+
+    Args:
+        setup (callable): Returns the argument passed to run, not timed
+        run (callable): Code to benchmark
+        n_frames (int): Number of audio frames processed by one run
+        repeat (int): Number of timed runs
+
+    Returns:
+        dict: wall time, samples/sec and peak RSS
+    """
+    arg = setup()
+    rss_before = peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    wall = min(times)
+    return {
+        'wall': wall,
+        'samples_per_sec': n_frames / wall if wall > 0 else float('inf'),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - rss_before
+    }
+
+def run_isolated(func, *args) -> dict:
+    """Run func(*args) in a fresh process so peak RSS only covers that case"""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(func, args)
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def save_results(path: str, name: str, results: list[dict]) -> None:
+    """Save results as JSON with the commit and environment they were measured on"""
+    with open(path, 'w') as f:
+        json.dump({
+            'benchmark': name,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'results': results
+        }, f, indent=2)
+    print(f'Results saved as {path}')
+
+def case_label(result: dict) -> str:
+    return result['stage'] + ' ' + ' '.join(f'{k}={v}' for k, v in result['params'].items())
+
+def print_results(results: list[dict]) -> None:
+    for result in results:
+        print(f'{case_label(result):<70} {result["wall"]*1000:10.2f} ms '
+              f'{result["samples_per_sec"]/1e6:10.2f} Msamples/s {result["peak_rss_mb"]:8.1f} MB')
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print the speedup of every case present in both result files"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_results = {case_label(r): r for r in old['results']}
+    print(f'{old["commit"]} -> {new["commit"]}')
+    for result in new['results']:
+        label = case_label(result)
+        if label not in old_results:
+            continue
+        before = old_results[label]
+        speedup = before['wall'] / result['wall'] if result['wall'] > 0 else float('inf')
+        print(f'{label:<70} {before["wall"]*1000:10.2f} -> {result["wall"]*1000:10.2f} ms '
+              f'({speedup:5.2f}x)  {before["peak_rss_mb"]:8.1f} -> {result["peak_rss_mb"]:8.1f} MB')
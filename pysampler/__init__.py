@@ -1,2 +1,6 @@
 from .sequencer import Sequencer
-from .library import Library
\ No newline at end of file
+from .library import Library
+from .batch import render_batch
+from .render_cache import RenderCache
+from .playback import Player
+from .arrangement import Arrangement, Pattern
@@ -0,0 +1,277 @@
+import hashlib
+from typing import Optional
+
+import numpy as np
+
+from .step import StepStore
+from .scheduler import EventList
+from .util import db_to_linear
+
+class Pattern:
+    """Named steps for one or more tracks, placed on an Arrangement timeline
+
+    Every track of a pattern has its own StepStore. Tracks without steps in
+    a pattern are silent while it plays.
+    """
+
+    def __init__(self, name: str, n_steps: Optional[int] = None) -> None:
+        """
+        Args:
+            name (str): Pattern name
+            n_steps (int): Length of the pattern in steps, defaults to its longest track
+        """
+        self.name = name
+        self.n_steps = n_steps
+        self.steps: dict[str, StepStore] = {}
+
+    def __len__(self) -> int:
+        if self.n_steps is not None:
+            return self.n_steps
+        return max((len(steps) for steps in self.steps.values()), default=0)
+
+    def set_track(
+            self,
+            track: str,
+            step_seq: list[int],
+            vel_seq: Optional[list[int]] = None,
+            pitch_seq: Optional[list[float]] = None,
+            delay: float = 0.0
+        ) -> StepStore:
+        """Set the steps of a track in this pattern
+
+        Args:
+            track (str): Track name
+            step_seq (list[int]): 1 or 0 for every step
+            vel_seq (list[int]): Step velocities (0-127), repeated to the length of step_seq
+            pitch_seq (list[float]): Step pitches in semitones, repeated to the length of step_seq
+            delay (float): Delay all steps by a factor of 1 step
+
+        Returns:
+            StepStore: Steps of the track
+        """
+        n = len(step_seq)
+        vel = np.resize(vel_seq, n) if vel_seq is not None and len(vel_seq) else 127
+        pitch = np.resize(pitch_seq, n) if pitch_seq is not None and len(pitch_seq) else 0
+        self.steps[track] = StepStore.from_columns(n, gate=np.asarray(step_seq, dtype=bool), vel=vel, pitch=pitch, delay=delay)
+        return self.steps[track]
+
+    def digest(self) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((self.name, len(self))).encode())
+        for track in sorted(self.steps):
+            h.update(track.encode())
+            h.update(self.steps[track].digest().encode())
+        return h.hexdigest()
+
+class Instance:
+    """A pattern placed on the timeline"""
+
+    def __init__(self, pattern: str, start: int, mutes: tuple = (), transpose: float = 0, gain: float = 0) -> None:
+        """
+        Args:
+            pattern (str): Pattern name
+            start (int): Start in steps
+            mutes (tuple[str]): Names of tracks muted in this instance
+            transpose (float): Semitones added to every step
+            gain (float): Gain in dB added to every step
+        """
+        self.pattern = pattern
+        self.start = start
+        self.mutes = frozenset(mutes)
+        self.transpose = transpose
+        self.gain = gain
+
+    def __repr__(self) -> str:
+        return f'Instance({self.pattern!r}, start={self.start}, mutes={sorted(self.mutes)}, transpose={self.transpose}, gain={self.gain})'
+
+class Arrangement:
+    """Song made of patterns placed on a timeline
+
+    Assign it to Sequencer.arrangement and renders, streams, playback and
+    export_midi follow the timeline instead of the steps of each track.
+    Tracks still own samples, effects, volume and pitch. Steps are stored once
+    per pattern and events are compiled per instance, so memory follows the
+    unique content rather than the length of the song, and repeated instances
+    are mixed once (see Layer.mix_segments).
+    """
+
+    def __init__(self) -> None:
+        self.patterns: dict[str, Pattern] = {}
+        self.timeline: list[Instance] = []
+
+    def add_pattern(self, name: str, tracks: dict[str, dict], n_steps: Optional[int] = None) -> Pattern:
+        """Define a pattern, replacing any pattern of the same name
+
+        Args:
+            name (str): Pattern name
+            tracks (dict): Pattern.set_track arguments by track name, eg. {'kick': {'step_seq': [1,0,0,0]}}
+            n_steps (int): Length of the pattern in steps, defaults to its longest track
+
+        Returns:
+            Pattern: The new pattern
+        """
+        pattern = Pattern(name, n_steps)
+        for track, params in tracks.items():
+            pattern.set_track(track, **params)
+        self.patterns[name] = pattern
+        return pattern
+
+    def place(
+            self,
+            pattern: str,
+            start: Optional[int] = None,
+            repeat: int = 1,
+            mutes: tuple = (),
+            transpose: float = 0,
+            gain: float = 0
+        ) -> list[Instance]:
+        """Place a pattern on the timeline, back to back repeat times
+
+        Args:
+            pattern (str): Pattern name
+            start (int): Start in steps, defaults to the end of the timeline
+            repeat (int): Number of consecutive instances
+            mutes (tuple[str]): Names of tracks muted in these instances
+            transpose (float): Semitones added to every step
+            gain (float): Gain in dB added to every step
+
+        Returns:
+            list[Instance]: The new instances
+        """
+        if pattern not in self.patterns:
+            raise ValueError(f'Unknown pattern {pattern!r}')
+        length = len(self.patterns[pattern])
+        if start is None:
+            start = len(self)
+        instances = [Instance(pattern, start + i * length, mutes, transpose, gain) for i in range(repeat)]
+        self.timeline += instances
+        return instances
+
+    def __len__(self) -> int:
+        """Length of the song in steps"""
+        return max((instance.start + len(self.patterns[instance.pattern]) for instance in self.timeline), default=0)
+
+    def digest(self) -> str:
+        """Stable hash of the patterns and the timeline"""
+        h = hashlib.blake2b(digest_size=16)
+        for name in sorted(self.patterns):
+            h.update(self.patterns[name].digest().encode())
+        for instance in self.timeline:
+            h.update(repr((instance.pattern, instance.start, sorted(instance.mutes), instance.transpose, instance.gain)).encode())
+        return h.hexdigest()
+
+    def track_digest(self, track_name: str) -> str:
+        """Stable hash of what a track plays in the arrangement"""
+        h = hashlib.blake2b(digest_size=16)
+        for instance, steps in self._track_instances(track_name):
+            h.update(repr((instance.start, instance.transpose, instance.gain)).encode())
+            h.update(steps.digest().encode())
+        return h.hexdigest()
+
+    def _track_instances(self, track_name: str):
+        """Instances which play a track, with the steps of the track in their pattern"""
+        for instance in self.timeline:
+            steps = self.patterns[instance.pattern].steps.get(track_name)
+            if steps is not None and len(steps) and track_name not in instance.mutes:
+                yield instance, steps
+
+    def compile_events(self, tracks: list, bpm: float, grid: float, sr: int, vol: float = 0) -> tuple[list[EventList], int]:
+        """Compile the timeline to event lists, like scheduler.compile_events does for track steps
+
+        Args:
+            tracks (list[Track]): Tracks of the sequence
+            bpm (float): Sequence tempo
+            grid (float): Sequence grid resolution
+            sr (int): Sample rate
+            vol (float): Sequence volume in dB scale
+
+        Returns:
+            (list[EventList], int): Event list per track and length of song in samples
+        """
+        names = {track.name for track in tracks}
+        for pattern in self.patterns.values():
+            for name in pattern.steps:
+                if name not in names:
+                    raise ValueError(f'Pattern {pattern.name!r} has steps for unknown track {name!r}')
+
+        step_len_beats = grid*4
+        step_len_samples = sr/(bpm/60)
+        seq_len_samples = int(len(self) * step_len_samples * step_len_beats)
+
+        event_lists = []
+        for track in tracks:
+            t, vel_db, pitch, step_index = [], [], [], []
+            for instance, steps in self._track_instances(track.name):
+                step = np.flatnonzero(steps.gate)
+                t.append(instance.start + step + steps.swing[step] + steps.delay[step] + steps.humanize[step])
+                with np.errstate(divide='ignore'):
+                    vel_db.append(20 * np.log10(steps.vel[step] / 127) + instance.gain)
+                pitch.append(steps.pitch[step] + instance.transpose)
+                step_index.append(instance.start + step)
+
+            if t:
+                t, vel_db, pitch, step_index = (np.concatenate(column) for column in (t, vel_db, pitch, step_index))
+            else:
+                t, vel_db, pitch, step_index = np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+            order = np.argsort(t, kind='stable')
+            onset = (t[order] * step_len_beats * step_len_samples).astype(np.int64)
+
+            # Each event lasts until the next one, the last one until the end of the song
+            length = np.empty_like(onset)
+            length[:-1] = np.diff(onset)
+            length[-1:] = seq_len_samples - onset[-1:]
+
+            event_lists.append(EventList(
+                onset = onset,
+                length = length,
+                vol = vol + vel_db[order],
+                pitch = pitch[order] + track.pitch,
+                step = step_index[order]
+            ))
+
+        return event_lists, seq_len_samples
+
+    def segment_starts(self, bpm: float, grid: float, sr: int) -> np.ndarray:
+        """Start of every instance in samples, where repeated content can be reused"""
+        step_len_samples = sr/(bpm/60) * grid*4
+        return np.unique([int(instance.start * step_len_samples) for instance in self.timeline]).astype(np.int64)
+
+    def export_midi(self, tracks: list, path: str = 'midi.mid', name_meta: str = 'Midi') -> None:
+        """Write the notes of the timeline to a MIDI file, like Sequencer.export_midi
+
+        Muted tracks are left out, transposition is added to the note and
+        gain scales the velocity.
+        """
+        import mido
+
+        midi_file = mido.MidiFile()
+        DEFAULT_MIDI_NOTE = 48
+        # TODO: Account for grids that arent 1/16
+        QUARTER_NOTE = int(midi_file.ticks_per_beat / 4)
+
+        midi_tracks = []
+        for track_index, track in enumerate(tracks):
+            midi_note = track.midi_note if track.midi_note is not None else DEFAULT_MIDI_NOTE + track_index
+
+            # Absolute (tick, order, message) tuples, note offs sort before note ons at the same tick
+            messages = []
+            for instance, steps in self._track_instances(track.name):
+                note = int(np.clip(midi_note + round(instance.transpose), 0, 127))
+                # Steps with a velocity of 0 render silent, so they are not notes either
+                for step in np.flatnonzero(steps.gate & (steps.vel > 0)):
+                    on = max(int((instance.start + step + steps.delay[step] + steps.swing[step] + steps.humanize[step]) * QUARTER_NOTE), 0)
+                    velocity = int(np.clip(round(steps.vel[step] * db_to_linear(instance.gain)), 1, 127))
+                    messages.append((on, 1, mido.Message('note_on', note=note, velocity=velocity)))
+                    messages.append((on + QUARTER_NOTE, 0, mido.Message('note_off', note=note, velocity=velocity)))
+            messages.sort(key=lambda message: message[:2])
+
+            midi_track = mido.MidiTrack()
+            tick = 0
+            for on, _, message in messages:
+                midi_track.append(message.copy(time=on - tick))
+                tick = on
+            midi_track.name = name_meta
+            midi_tracks.append(midi_track)
+
+        midi_file.tracks.append(mido.merge_tracks(midi_tracks))
+        midi_file.save(path)
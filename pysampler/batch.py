@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import random
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Optional, Union
+
+import numpy as np
+import soundfile as sf
+
+from .sequencer import Sequencer
+from .render_cache import RenderCache
+from .cache import sample_pool
+from .util import Fore, Style
+
+class BatchReport:
+    """Summary of a render_batch call"""
+
+    def __init__(self, n_rendered: int, n_failed: int, elapsed: float, manifest_path: str) -> None:
+        self.n_rendered = n_rendered
+        self.n_failed = n_failed
+        self.elapsed = elapsed
+        self.manifest_path = manifest_path
+
+    @property
+    def loops_per_sec(self) -> float:
+        return self.n_rendered / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (f'BatchReport(n_rendered={self.n_rendered}, n_failed={self.n_failed}, '
+                f'elapsed={self.elapsed:.2f}, loops_per_sec={self.loops_per_sec:.2f})')
+
+def build_sequencer(spec: dict) -> Sequencer:
+    """Create a Sequencer from a spec dict
+
+    Example spec:
+    {
+        "bpm": 90,
+        "grid": 1/16,
+        "tracks": [
+            {"name": "kick", "step_seq": [1,0,0,0], "sample": "kick.wav"},
+            {"name": "hihat", "step_seq": [1,1,1,1], "sample": "hihat.wav", "effects": [Gain(-6)]}
+        ],
+        "effects": [SoftClip(-6)],
+        "duplicate_time": 2
+    }
+    Track dicts take the arguments of Sequencer.add_track, plus an optional list of effects.
+    """
+    seq = Sequencer(bpm=spec.get('bpm', 120), grid=spec.get('grid', 1/16))
+    seq.vol = spec.get('vol', 0)
+    for track_spec in spec.get('tracks', []):
+        track_spec = dict(track_spec)
+        effects = track_spec.pop('effects', [])
+        seq.add_track(**track_spec)
+        for effect in effects:
+            seq.tracks[-1].add_effect(effect)
+    for effect in spec.get('effects', []):
+        seq.add_effect(effect)
+    if spec.get('duplicate_time', 0):
+        seq.duplicate_time(spec['duplicate_time'])
+    return seq
+
+def _render_item(
+        index: int,
+        spec,
+        seed: int,
+        out_dir: str,
+        sr: int,
+        normalize_output: bool,
+        render_cache: Optional[RenderCache] = None
+    ) -> dict:
+    """Seed, build and render a single spec. Runs in a worker process"""
+    entry = {'index': index, 'seed': seed}
+    try:
+        random.seed(seed)
+        np.random.seed(seed)
+
+        # Callables are called after seeding, so random patterns and samples are reproducible
+        if callable(spec):
+            spec = spec()
+        if isinstance(spec, Sequencer):
+            seq, filename = spec, None
+        else:
+            seq, filename = build_sequencer(spec), spec.get('filename')
+        if filename is None:
+            filename = f'{index:06d}.wav'
+
+        path = os.path.join(out_dir, filename)
+        seq.render(path, sr=sr, normalize_output=normalize_output, verbose=False, render_cache=render_cache)
+
+        entry.update({
+            'filename': path,
+            'bpm': seq.bpm,
+            'grid': seq.grid,
+            'duration': sf.info(path).duration,
+            'tracks': [
+                {'name': track.name, 'samples': [sample.path for sample in track.samples]}
+                for track in seq.tracks
+            ]
+        })
+    except Exception as e:
+        entry['error'] = f'{type(e).__name__}: {e}'
+    return entry
+
+def render_batch(
+        specs: Iterable[Union[dict, Callable, Sequencer]],
+        out_dir: str = 'renders',
+        workers: Optional[int] = None,
+        seed: int = 0,
+        sr: int = 44100,
+        normalize_output: bool = True,
+        preload: Optional[list[str]] = None,
+        manifest: str = 'manifest.jsonl',
+        verbose: bool = True,
+        render_cache: Optional[RenderCache] = None
+    ) -> BatchReport:
+    """Render many sequences across a process pool
+
+    Each spec is a dict for build_sequencer, a Sequencer, or a picklable
+    callable returning either. Specs may come from a generator, only a few per
+    worker are in flight at a time. Before each item, random and np.random are
+    seeded with the spec's 'seed' key, or seed + index, so callables using
+    patterns.gen_ksh or Library.random_by_type are reproducible.
+
+    Samples listed in preload are decoded into the sample pool before the
+    workers start, so forked workers share them. Each worker also keeps its
+    own pool between items.
+
+    Every item gets a line in the JSON lines manifest, with its file, seed and
+    tracks, or the error which stopped it.
+
+    Args:
+        specs (iterable): Sequence specs
+        out_dir (str): Folder for rendered files and manifest
+        workers (int): Number of processes, defaults to the number of CPUs, 0 renders in this process
+        seed (int): Base seed for items without their own
+        sr (int): Sample rate
+        normalize_output (bool): If each render is to be normalized
+        preload (list[str]): Sample paths to decode before starting workers
+        manifest (str): Manifest filename inside out_dir
+        verbose (bool): Print progress and throughput
+        render_cache (RenderCache): Copy items rendered before from this cache, shared by all workers
+
+    Returns:
+        BatchReport: Counts, elapsed time and loops per second
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, manifest)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    for path in preload or []:
+        sample_pool.load(path)
+
+    def jobs():
+        for index, spec in enumerate(specs):
+            item_seed = spec.get('seed', seed + index) if isinstance(spec, dict) else seed + index
+            yield index, spec, item_seed, out_dir, sr, normalize_output, render_cache
+
+    n_rendered = n_failed = 0
+    start = time.perf_counter()
+
+    def record(entry, f):
+        nonlocal n_rendered, n_failed
+        f.write(json.dumps(entry) + '\n')
+        if 'error' in entry:
+            n_failed += 1
+            if verbose:
+                print(f'{Fore.RED}> Item {entry["index"]} failed: {entry["error"]}')
+        else:
+            n_rendered += 1
+
+    with open(manifest_path, 'w') as f:
+        if workers == 0:
+            for job in jobs():
+                record(_render_item(*job), f)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = set()
+                for job in jobs():
+                    # Keep a bounded number of items in flight
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(future.result(), f)
+                    pending.add(pool.submit(_render_item, *job))
+                for future in wait(pending).done:
+                    record(future.result(), f)
+
+    report = BatchReport(n_rendered, n_failed, time.perf_counter() - start, manifest_path)
+    if verbose:
+        print(f'{Fore.GREEN}✅ Rendered {n_rendered} loops in {report.elapsed:.2f}s '
+              f'({Style.BRIGHT}{report.loops_per_sec:.2f} loops/sec{Style.NORMAL}), manifest saved as {manifest_path}')
+    return report
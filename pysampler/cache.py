@@ -0,0 +1,333 @@
+from collections import OrderedDict
+import os
+import json
+import hashlib
+import threading
+
+import soundfile as sf
+import numpy as np
+
+from .effects import pitch_resample, normalize
+
+class LRUCache:
+    """Buffers held under a byte budget, least recently used ones are dropped first
+
+    Holds the counters, the eviction and the locking shared by SamplePool and
+    ResampleCache. Entries are stored with their size in bytes, so any value
+    (eg. a buffer with its sample rate) can be held.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._buffers: OrderedDict[tuple, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock() # Tracks may be rendered from several threads
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def _lookup(self, key: tuple):
+        """Returns the value stored under key and counts a hit, or None and counts a miss"""
+        with self._lock:
+            entry = self._buffers.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._buffers.move_to_end(key)
+            return entry[0]
+
+    def _store(self, key: tuple, value, nbytes: int) -> None:
+        """Store a value, dropping least recently used ones until we are within budget
+        Values larger than the whole budget are never stored"""
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._buffers:
+                return
+            self._buffers[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and self._buffers:
+                _, (_, old_nbytes) = self._buffers.popitem(last=False)
+                self.nbytes -= old_nbytes
+
+    def clear(self) -> None:
+        """Drop all buffers and reset hit/miss counters"""
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        # Called with the lock held, subclasses reset their own state too
+        self._buffers.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and memory usage"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._buffers),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes
+        }
+
+class SamplePool(LRUCache):
+    """Process-wide pool of decoded, normalized, stereo sample buffers
+
+    Buffers are keyed by absolute path plus file mtime and size, so an edited
+    file is decoded again, and by dtype, so float32 renders get their own
+    decoded copy. Buffers are handed out read-only and shared between
+    every Sample, Track and Sequencer using the same file.
+    Least recently used buffers are dropped once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 1024 ** 3) -> None:
+        super().__init__(max_bytes)
+        self._digests: dict[tuple, str] = {} # File content hashes by key
+        self._peaks: dict[tuple, float] = {} # Peaks of lazy samples by key
+
+    def key(self, path: str) -> tuple:
+        """Returns the pool key for a file path"""
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def load(self, path: str, dtype = np.float64) -> tuple[np.ndarray, int, tuple]:
+        """Get decoded sample data for a file, decoding only on a miss
+
+        Args:
+            path (str): Sample file
+            dtype: np.float64 or np.float32
+
+        Returns:
+            (ndarray, int, tuple): Read-only stereo data, sample rate and pool key
+        """
+        key = self.key(path)
+        buffer_key = (key, np.dtype(dtype).str)
+        entry = self._lookup(buffer_key)
+        if entry is not None:
+            return entry[0], entry[1], key
+
+        data, sr = decode(path, dtype)
+        data.flags.writeable = False
+        self._store(buffer_key, (data, sr), data.nbytes)
+        return data, sr, key
+
+    def digest(self, key: tuple) -> str:
+        """Returns a hash of the file contents behind a pool key, computed once per key"""
+        digest = self._digests.get(key)
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            with open(key[0], 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def peak(self, key: tuple, frames = None, block_size: int = 1 << 18) -> float:
+        """Returns the peak of the file behind a pool key, read block by block once per key
+
+        Args:
+            key (tuple): Pool key
+            frames (LazyFrames): Open frames of the file, read instead of opening it again
+            block_size (int): Frames decoded at a time
+        """
+        peak = self._peaks.get(key)
+        if peak is None:
+            frames = LazyFrames(key[0]) if frames is None else frames
+            peak = 0.0
+            for start in range(0, len(frames), block_size):
+                block = frames[start : start + block_size]
+                peak = max(peak, float(np.max(block)), -float(np.min(block)))
+            with self._lock:
+                self._peaks[key] = peak
+        return peak
+
+    def _clear(self) -> None:
+        super()._clear()
+        self._digests.clear()
+        self._peaks.clear()
+
+def decode(path: str, dtype = np.float64) -> tuple[np.ndarray, int]:
+    """Read a .wav file as normalized stereo data using soundfile"""
+    data, sr = sf.read(file=path, dtype=np.dtype(dtype).name)
+
+    # Convert mono samples to stereo
+    # TODO: use always2d=True in sf.read instead (didnt work properly)
+    #   (try changing the shape of array)
+    if len(data.shape) != 2:
+        data = np.repeat(data[:, np.newaxis], 2, axis=1) # Frames stay contiguous rows
+
+    # Normalize, in place as data is ours
+    data = normalize(data, out=data)
+    return data, sr
+
+class LazyFrames:
+    """Frames of a sound file, read from disk when sliced
+
+    Behaves like a read-only (frames, channels) float32 array for slicing,
+    so only the frames a step actually plays are decoded. The file stays
+    open, reads are locked as tracks may be rendered from several threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._open()
+        self.sr = self._file.samplerate
+        self.shape = (self._file.frames, self._file.channels)
+        self.dtype = np.dtype(np.float32)
+
+    def _open(self) -> None:
+        self._file = sf.SoundFile(self.path)
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The file is opened again after unpickling
+        state = self.__dict__.copy()
+        del state['_file'], state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, index) -> np.ndarray:
+        if not isinstance(index, slice):
+            raise TypeError('LazyFrames only supports slices')
+        start, stop, step = index.indices(self.shape[0])
+        if step != 1:
+            raise ValueError('LazyFrames only supports contiguous slices')
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(max(stop - start, 0), dtype='float32', always_2d=True)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __array__(self, dtype = None, copy = None) -> np.ndarray:
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+def mmap_path(key: tuple, cache_dir: str) -> str:
+    """Path of the .npy copy of a sample file version"""
+    name = os.path.splitext(os.path.basename(key[0]))[0]
+    version = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f'{name}.{version}.npy')
+
+def load_mmap(path: str, cache_dir = None, block_size: int = 1 << 18) -> tuple[np.memmap, int, tuple, float]:
+    """Memory-map a raw float32 .npy copy of a sample, writing it on first use
+
+    The copy keeps the original channels and is not normalized, its peak is
+    saved alongside it so normalizing is a gain. It is written block by block,
+    so the file is never fully decoded in memory.
+
+    Args:
+        path (str): Sample file
+        cache_dir (str): Folder of .npy copies, defaults to .pysampler next to the sample
+        block_size (int): Frames decoded at a time when writing the copy
+
+    Returns:
+        (memmap, int, tuple, float): Read-only (frames, channels) data, sample rate, pool key and peak
+    """
+    key = sample_pool.key(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(key[0]), '.pysampler')
+    npy_path = mmap_path(key, cache_dir)
+    meta_path = os.path.splitext(npy_path)[0] + '.json'
+
+    if not os.path.exists(meta_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+        peak = 0.0
+        with sf.SoundFile(path) as f:
+            sr = f.samplerate
+            out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(f.frames, f.channels))
+            for start in range(0, f.frames, block_size):
+                block = f.read(block_size, dtype='float32', always_2d=True)
+                out[start : start + len(block)] = block
+                if len(block):
+                    peak = max(peak, float(np.max(block)), -float(np.min(block)))
+            out.flush()
+            del out
+        os.replace(tmp_path, npy_path)
+        # The metadata is written last, it marks the copy as complete
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'path': key[0], 'sr': sr, 'peak': peak}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return np.load(npy_path, mmap_mode='r'), meta['sr'], key, meta['peak']
+
+class ResampleCache(LRUCache):
+    """Bounded LRU cache of pitch shifted and sample rate converted sample buffers
+
+    Buffers are keyed by sample identity, semitone offset, source and target
+    sample rates, resampler quality and dtype, and live across
+    Sequencer.render() calls.
+    Least recently used buffers are dropped once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, res_type: str = 'soxr_vhq') -> None:
+        super().__init__(max_bytes)
+        self.res_type = res_type
+        self.bytes_resampled = 0 # Total size of buffers created on misses
+
+    def resample(self, sample, n: float, dtype = np.float64, sr: int = None) -> np.ndarray:
+        """Get sample data pitched by n semitones at the sample rate sr, resampling only on a miss
+        The pitch shift and sample rate conversion are done by a single resample
+
+        Args:
+            sample (Sample): Sample to pitch
+            n (float): Number of semitones
+            dtype: np.float64 or np.float32, resampling runs in this precision
+            sr (int): Sample rate of the render, defaults to the sample's own
+
+        Returns:
+            ndarray: Read-only pitched sample data
+        """
+        sr = sample.sr if sr is None else sr
+        key = (sample.key, sample.mode, n, sample.sr, sr, self.res_type, np.dtype(dtype).str)
+        y = self._lookup(key)
+        if y is not None:
+            return y
+
+        # Mapped and lazy samples are resampled from their float32 frames
+        y = pitch_resample(np.asarray(sample.get_data(dtype)), n, orig_sr=sample.sr, res_type=self.res_type, target_sr=sr)
+        y = np.ascontiguousarray(y) # Frames as contiguous rows, see mixer.mix_kernel
+        y.flags.writeable = False
+        with self._lock:
+            self.bytes_resampled += y.nbytes
+        self._store(key, y, y.nbytes)
+        return y
+
+    def __getstate__(self) -> dict:
+        # Buffers stay in this process, an unpickled cache starts empty
+        state = self.__dict__.copy()
+        state.update(_buffers=OrderedDict(), _lock=None, nbytes=0, hits=0, misses=0, bytes_resampled=0)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _clear(self) -> None:
+        super()._clear()
+        self.bytes_resampled = 0
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'bytes_resampled': self.bytes_resampled}
+
+# Shared by all samples in the process
+sample_pool = SamplePool()
+
+# Shared by all sequencers unless replaced via Sequencer.resample_cache
+resample_cache = ResampleCache()
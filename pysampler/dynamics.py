@@ -0,0 +1,132 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from .util import has_module, lazy_jit
+
+def gain_computer(level_db: np.ndarray, threshold: float, ratio: float, knee: float = 0) -> np.ndarray:
+    """Static compression curve, returns the gain reduction in dB (<= 0) for each level
+
+    Args:
+        level_db (ndarray): Detector level in dB
+        threshold (float): Threshold in dB
+        ratio (float): Compression ratio, np.inf for a limiter
+        knee (float): Soft knee width in dB, 0 for a hard knee
+    """
+    slope = 1 / ratio - 1
+    over = level_db - threshold
+    reduction = np.where(over > 0, slope * over, 0.0)
+    if knee > 0:
+        in_knee = np.abs(over) <= knee / 2
+        reduction = np.where(in_knee, slope * (over + knee / 2) ** 2 / (2 * knee), reduction)
+    return reduction
+
+def _smooth_gain_loop(target: np.ndarray, attack: float, release: float, gain: float) -> tuple:
+    """Attack/release smoothing of the gain reduction in dB, one sample at a time
+    Falls towards more reduction with the attack coefficient, recovers with the release one"""
+    out = np.empty_like(target)
+    for i in range(target.shape[0]):
+        t = target[i]
+        coeff = attack if t < gain else release
+        gain = coeff * gain + (1 - coeff) * t
+        out[i] = gain
+    return out, gain
+
+def _smooth_gain_python(target: np.ndarray, attack: float, release: float, gain: float) -> tuple:
+    """_smooth_gain_loop on Python floats, a few times faster than indexing arrays"""
+    out = []
+    append = out.append
+    for t in target.tolist():
+        coeff = attack if t < gain else release
+        gain = coeff * gain + (1 - coeff) * t
+        append(gain)
+    return np.array(out, dtype=np.float64), gain
+
+# Without numba, gain smoothing falls back to a Python loop
+smooth_gain = lazy_jit(_smooth_gain_loop) if has_module('numba') else _smooth_gain_python
+
+def time_coefficient(seconds: float, sr: int) -> float:
+    """One-pole coefficient reaching 1 - 1/e of a step in the given time"""
+    if seconds <= 0:
+        return 0.0
+    return math.exp(-1 / (seconds * sr))
+
+def compress(
+        audio: np.ndarray,
+        sr: int = 44100,
+        threshold: float = -12,
+        ratio: float = 4,
+        attack: float = 0.01,
+        release: float = 0.1,
+        knee: float = 0,
+        makeup: float = 0,
+        detector: str = 'peak',
+        rms_window: float = 0.01,
+        lookahead: float = 0,
+        key: Optional[np.ndarray] = None,
+        state: Optional[dict] = None
+    ) -> tuple[np.ndarray, dict]:
+    """Feed-forward compressor with stereo linked detection
+
+    The detector follows the peak or RMS level of the key (the audio itself
+    unless a sidechain key is given), the gain computer maps it to a gain
+    reduction, which is smoothed with the attack and release times.
+    Lookahead delays the audio against the detector, so peaks are caught
+    before they pass; it adds lookahead seconds of latency, which
+    effects.Dynamics reports so renders line the audio up again.
+
+    Args:
+        audio (ndarray): Stereo audio
+        sr (int): Sample rate
+        threshold (float): Threshold in dB
+        ratio (float): Compression ratio, np.inf for a limiter
+        attack (float): Attack time in seconds
+        release (float): Release time in seconds
+        knee (float): Soft knee width in dB
+        makeup (float): Makeup gain in dB
+        detector (str): 'peak' or 'rms'
+        rms_window (float): Time constant of the RMS detector in seconds
+        lookahead (float): Lookahead in seconds
+        key (ndarray): Sidechain key, same length as audio
+        state (dict): State returned for the previous block, None for the first
+
+    Returns:
+        (ndarray, dict): Compressed audio and the state to pass with the next block
+    """
+    if detector not in ('peak', 'rms'):
+        raise ValueError("detector must be 'peak' or 'rms'")
+    n_lookahead = int(round(lookahead * sr))
+    if state is None:
+        state = {
+            'gain': 0.0,
+            'rms': np.zeros(1),
+            'delay': np.zeros((n_lookahead, audio.shape[1]), dtype=audio.dtype)
+        }
+    key = audio if key is None else key
+
+    # Stereo linked level of the key
+    if detector == 'peak':
+        level = np.max(np.abs(key), axis=1).astype(np.float64)
+    else:
+        import scipy.signal
+        coeff = time_coefficient(rms_window, sr)
+        power = np.mean(np.square(key, dtype=np.float64), axis=1)
+        power, rms = scipy.signal.lfilter([1 - coeff], [1, -coeff], power, zi=state['rms'])
+        state['rms'] = rms
+        level = np.sqrt(np.maximum(power, 0))
+    level_db = 20 * np.log10(np.maximum(level, 1e-10))
+
+    target = gain_computer(level_db, threshold, ratio, knee)
+    gain_db, state['gain'] = smooth_gain(
+        target, time_coefficient(attack, sr), time_coefficient(release, sr), float(state['gain'])
+    )
+    gain = np.power(10, (gain_db + makeup) / 20)
+
+    # Delay the audio behind the detector
+    if n_lookahead:
+        delayed = np.concatenate((state['delay'], audio))
+        state['delay'] = delayed[len(audio):].copy()
+        audio = delayed[:len(audio)]
+
+    return (audio * gain[:, np.newaxis]).astype(audio.dtype, copy=False), state
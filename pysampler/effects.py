@@ -1,74 +1,362 @@
 import numpy as np
 import math
-import scipy.signal
-import librosa
+import time
 
 from .util import *
+from .dynamics import compress
+from . import filters
 
 # Wrapper Classes
 # (This lets us store effects as objects per track or sequence)
 # (Processing happens in Sequencer.render())
 
-class Compressor:
+class Effect:
+    """Base class of the effect wrappers
+
+    process() handles a whole buffer. process_block() handles consecutive
+    blocks of the same audio, carrying state (filter memory, compressor
+    envelope) from one block to the next, so a buffer processed in blocks
+    gives the same output as processed whole. reset() starts a new stream.
+    Effects which need the whole buffer (eg. to find its peak) have streams = False.
+
+    Subclasses implement _process(audio, sr, state), which returns the output
+    and the state for the next block. state is None on the first block.
+    State is kept in underscore attributes, it is not an effect parameter.
+
+    Pointwise effects (gain, clipping, normalize) have pointwise = True and
+    also implement process_inplace(audio, sr), which EffectChain uses to
+    process a buffer without allocating.
+
+    Effects whose output lags their input (eg. a lookahead delay) report it
+    with latency(sr), and their output is lined up with the input again:
+    process() flushes the delay with silence, and process_block() drops the
+    first latency(sr) samples of the stream, so the first blocks come out
+    shorter and the stream ends once as much silence has been processed.
+    """
+    streams = True
+    pointwise = False
+    _state = None
+    _skip = None # Samples of the stream still to drop
+
+    def latency(self, sr: int = 44100) -> int:
+        """Samples by which the output of _process() lags its input"""
+        return 0
+
+    def process(self, audio: np.ndarray, sr: int = 44100) -> np.ndarray:
+        """Process a whole buffer, independently of any stream"""
+        latency = self.latency(sr)
+        if latency:
+            audio = pad_end(audio, latency)
+        return self._process_whole(audio, sr)
+
+    def process_block(self, block: np.ndarray, sr: int = 44100) -> np.ndarray:
+        """Process the next block of a stream"""
+        if not self.streams:
+            raise ValueError(f'{type(self).__name__} cannot process audio in blocks')
+        if self._skip is None:
+            self._skip = self.latency(sr)
+        output, self._state = self._process(block, sr, self._state)
+        if self._skip:
+            skipped = min(self._skip, len(output))
+            output = output[skipped:]
+            self._skip -= skipped
+        return output
+
+    def reset(self) -> None:
+        """Forget the state of the previous stream"""
+        self._state = None
+        self._skip = None
+
+    def _process_whole(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        """Process a whole buffer already followed by latency(sr) samples of silence"""
+        output = self._process(audio, sr, None)[0]
+        latency = self.latency(sr)
+        return output[latency:] if latency else output
+
+    def _process(self, audio: np.ndarray, sr: int, state) -> tuple:
+        raise NotImplementedError
+
+class Compressor(Effect):
+    """Legacy compressor, its envelope only follows the running peak. See Dynamics"""
     def __init__(self,threshold,ratio,attack,release,gain):
         self.threshold = threshold
         self.ratio = ratio
         self.attack = attack
         self.release = release
         self.gain = gain
-    def process(self, audio):
-        audio = compressor(audio,self.threshold,self.ratio,self.attack, self.release, gain=self.gain)
-        return audio
+    def _process(self, audio, sr, state):
+        # State is the envelope peak of each channel
+        return compressor_block(audio,self.threshold,self.ratio,self.attack,self.release,sr,self.gain,envelope=state)
 
-class SoftClip:
+class Dynamics(Effect):
+    """Compressor with peak or RMS detection, soft knee, lookahead and sidechain
+    See dynamics.compress for the parameters
+
+    sidechain is a Track, or its name, whose dry layer mix keys the detector
+    instead of the audio itself. The Sequencer renders the key and passes it
+    with set_key() before processing.
+
+    Lookahead delays the audio, it is reported by latency() and dropped
+    again, so the track stays in time with the others.
+    """
+    def __init__(
+            self,
+            threshold: float = -12,
+            ratio: float = 4,
+            attack: float = 0.01,
+            release: float = 0.1,
+            knee: float = 0,
+            makeup: float = 0,
+            detector: str = 'peak',
+            rms_window: float = 0.01,
+            lookahead: float = 0,
+            sidechain = None
+        ):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.attack = attack
+        self.release = release
+        self.knee = knee
+        self.makeup = makeup
+        self.detector = detector
+        self.rms_window = rms_window
+        self.lookahead = lookahead
+        self.sidechain = getattr(sidechain, 'name', sidechain)
+        self._key = None
+        self._key_offset = 0
+    def latency(self, sr=44100):
+        # The lookahead delays the audio behind the detector
+        return int(round(self.lookahead * sr))
+    def set_key(self, key: np.ndarray, offset: int = 0):
+        """Set the sidechain key, key[0] being sample offset of the processed audio"""
+        self._key = key
+        self._key_offset = offset
+    def _process(self, audio, sr, state):
+        # State is the detector and smoothing memory, the lookahead delay line and the position in the stream
+        pos = 0 if state is None else state['pos']
+        key = None
+        if self.sidechain is not None:
+            if self._key is None:
+                raise ValueError(f'No key set for sidechain {self.sidechain!r}')
+            start = pos - self._key_offset
+            key = self._key[start : start + len(audio)]
+            if start < 0 or len(key) != len(audio):
+                raise ValueError(f'Key of sidechain {self.sidechain!r} does not cover the audio')
+        audio, state = compress(
+            audio, sr, self.threshold, self.ratio, self.attack, self.release, self.knee, self.makeup,
+            self.detector, self.rms_window, self.lookahead, key, state
+        )
+        state['pos'] = pos + len(audio)
+        return audio, state
+
+class Limiter(Dynamics):
+    """Dynamics with an infinite ratio, fast attack and lookahead"""
+    def __init__(self, threshold: float = -1, release: float = 0.05, lookahead: float = 0.005, attack: float = 0.001, sidechain = None):
+        super().__init__(threshold, np.inf, attack, release, lookahead=lookahead, sidechain=sidechain)
+
+class SoftClip(Effect):
+    pointwise = True
     def __init__(self, threshold: float = 0, gain: float = 0, auto_gain: bool = False):
         self.threshold = threshold
         self.gain = gain
         self.auto_gain = auto_gain
-    def process(self, audio):
+    @property
+    def streams(self):
+        # Auto gain normalizes over the whole buffer
+        return not self.auto_gain
+    def _process(self, audio, sr, state):
         audio = soft_clip(audio,self.threshold,self.gain,self.auto_gain)
-        return audio
+        return audio, None
+    def process_inplace(self, audio, sr=44100):
+        return soft_clip(audio,self.threshold,self.gain,self.auto_gain,out=audio)
 
-class HardClip:
+class HardClip(Effect):
+    pointwise = True
     def __init__(self, threshold: float = 0, gain: float = 0):
         self.threshold = threshold
         self.gain = gain
-    def process(self, audio):
+    def _process(self, audio, sr, state):
         audio = hard_clip(audio,self.threshold,self.gain)
-        return audio
+        return audio, None
+    def process_inplace(self, audio, sr=44100):
+        return hard_clip(audio,self.threshold,self.gain,out=audio)
 
-class Normalize:
+class Normalize(Effect):
+    streams = False
+    pointwise = True
     def __init__(self, max_level: float = 0):
         self.max_level = max_level
-    def process(self, audio: np.ndarray):
+    def _process(self, audio: np.ndarray, sr, state):
         audio = normalize(audio,self.max_level)
-        return audio
+        return audio, None
+    def process_inplace(self, audio, sr=44100):
+        return normalize(audio,self.max_level,out=audio)
 
-class Filter:
-    """Filter types: 'low', 'mid', 'high'"""
-    def __init__(self,filter_type,cutoff,order):
+class Filter(Effect):
+    """Filter types: 'low', 'band', 'high', 'bandstop' (Butterworth),
+    'lowshelf', 'highshelf', 'peak' (EQ, using gain and q)
+
+    Coefficients are designed once per sample rate as second-order sections.
+    zero_phase filters forwards and backwards, which can not stream.
+    """
+    def __init__(self, filter_type, cutoff, order = 4, gain: float = 0, q: float = 0.7071, zero_phase: bool = False):
         self.filter_type = filter_type
         self.cutoff = cutoff
         self.order = order
-    def process(self, audio):
-        audio = butterworth_filter(audio,self.filter_type,self.cutoff,self.order,sample_rate=44100)
-        return audio
+        self.gain = gain
+        self.q = q
+        self.zero_phase = zero_phase
+    @property
+    def streams(self):
+        return not self.zero_phase
+    def _process(self, audio, sr, state):
+        # State is the memory (zi) of each section and channel
+        sos = filters.design(self.filter_type, self.cutoff, self.order, sr, self.gain, self.q)
+        return filters.sos_filter(audio, sos, state, self.zero_phase)
+
+class EQ(Effect):
+    """Filters applied in a single pass, eg. a parametric EQ
+
+    Bands are dicts of Filter arguments:
+    EQ([
+        {'filter_type': 'high', 'cutoff': 40, 'order': 2},
+        {'filter_type': 'peak', 'cutoff': 400, 'gain': -3, 'q': 2},
+        {'filter_type': 'highshelf', 'cutoff': 8000, 'gain': 2}
+    ])
+    """
+    def __init__(self, bands: list[dict], zero_phase: bool = False):
+        self.bands = [dict(band) for band in bands]
+        self.zero_phase = zero_phase
+    @property
+    def streams(self):
+        return not self.zero_phase
+    def _process(self, audio, sr, state):
+        sos = np.concatenate([
+            filters.design(
+                band['filter_type'], band['cutoff'], band.get('order', 4), sr,
+                band.get('gain', 0), band.get('q', 0.7071)
+            )
+            for band in self.bands
+        ])
+        return filters.sos_filter(audio, sos, state, self.zero_phase)
 
-class PitchResample:
+class PitchResample(Effect):
+    streams = False # Changes the length of the audio
     def __init__(self, n: float, sr: int = 44100):
         self.n = n
         self.sr = sr
-    def process(self, audio):
+    def _process(self, audio, sr, state):
         audio = pitch_resample(audio,self.n,self.sr)
-        return audio
+        return audio, None
 
-class Gain:
+class Gain(Effect):
+    pointwise = True
     def __init__(self,gain=0):
         self.gain=gain
-    def process(self, audio):
+    def _process(self, audio, sr, state):
         audio = adjust_volume(audio,self.gain)
+        return audio, None
+    def process_inplace(self, audio, sr=44100):
+        return adjust_volume(audio,self.gain,out=audio)
+
+class EffectChain(Effect):
+    """Effects applied in order, pointwise effects run in place
+
+    The input is copied at most once, before the first pointwise effect
+    (or not at all with inplace=True). From then on, gain, clipping and
+    normalize work in place on the same buffer, and other effects run as
+    usual, their output becoming the buffer. The output is identical to
+    applying the effects one after the other.
+
+    Besides native effects, chains may hold pedalboard plugins and any
+    object with a process(audio) method.
+
+    The latency of a chain is the sum of the latencies of its effects. A
+    whole buffer is followed by that much silence, and every effect drops
+    its own lag, so each effect sees its input lined up with the sequence.
+    """
+    def __init__(self, effects: list):
+        self.effects = list(effects)
+    @property
+    def streams(self):
+        return all(is_plugin(effect) or (isinstance(effect, Effect) and effect.streams) for effect in self.effects)
+    def latency(self, sr=44100):
+        return sum(effect.latency(sr) for effect in self.effects if isinstance(effect, Effect))
+    def process(self, audio, sr=44100, inplace=False):
+        return self.run(audio, sr, stream=False, inplace=inplace)
+    def process_block(self, block, sr=44100, inplace=False):
+        if not self.streams:
+            raise ValueError('EffectChain contains effects which cannot process audio in blocks')
+        return self.run(block, sr, stream=True, inplace=inplace)
+    def reset(self):
+        for effect in self.effects:
+            if is_plugin(effect) or isinstance(effect, Effect):
+                effect.reset()
+    def _process_whole(self, audio, sr):
+        return self._run(audio, sr, stream=False, inplace=False, on_effect=None)
+    def run(self, audio, sr=44100, stream=False, inplace=False, on_effect=None):
+        """Apply the effects
+
+        Args:
+            audio (ndarray): Audio data
+            sr (int): Sample rate
+            stream (bool): Process the next block of a stream, carrying effect state.
+                The output is shorter than the block while the latency of the chain is dropped
+            inplace (bool): The input may be overwritten
+            on_effect (callable): Called with each effect, its duration, and the bytes it allocated
+
+        Returns:
+            ndarray: Processed audio, in the dtype of the input
+        """
+        latency = 0 if stream else self.latency(sr)
+        if latency:
+            # Flush the lag of the chain with silence, the padded copy is ours
+            audio = pad_end(audio, latency)
+            inplace = True
+        return self._run(audio, sr, stream, inplace, on_effect)
+    def _run(self, audio, sr, stream, inplace, on_effect):
+        owned = inplace # Whether we may write to audio
+        for effect in self.effects:
+            if not len(audio):
+                break # Everything so far was dropped as latency
+            start = time.perf_counter()
+            allocated = 0
+            if getattr(effect, 'pointwise', False) and not (stream and not effect.streams):
+                if not owned:
+                    audio = audio.copy()
+                    owned = True
+                    allocated = audio.nbytes
+                effect.process_inplace(audio, sr)
+                output = audio
+            elif is_plugin(effect):
+                output = effect.process(audio, sr, reset=not stream)
+            elif isinstance(effect, Effect):
+                output = effect.process_block(audio, sr) if stream else effect._process_whole(audio, sr)
+            else:
+                output = effect.process(audio)
+            if output.dtype != audio.dtype:
+                # Keep the input precision (pedalboard always returns float32)
+                output = output.astype(audio.dtype)
+            if output is not audio:
+                allocated = output.nbytes
+                # Fresh arrays are ours to overwrite, views of the input are only if the input was
+                if not np.may_share_memory(output, audio):
+                    owned = True
+            if on_effect is not None:
+                on_effect(effect, time.perf_counter() - start, allocated)
+            audio = output
         return audio
 
+def pad_end(audio: np.ndarray, n: int) -> np.ndarray:
+    """Copy of audio followed by n samples of silence"""
+    padded = np.zeros((len(audio) + n,) + audio.shape[1:], dtype=audio.dtype)
+    padded[:len(audio)] = audio
+    return padded
+
+def is_plugin(effect) -> bool:
+    """Whether an effect is a pedalboard plugin (VST3Plugin, Pedalboard, ...)"""
+    return type(effect).__module__.split('.')[0] in ('pedalboard', 'pedalboard_native')
+
 def apply_fadein(audio, sr=44100, fadein_duration=1):
     """Apply a fadein to audio data
     
@@ -103,10 +391,15 @@ def apply_fadeout(audio, sr=44100, fadeout_duration=1):
 
     return audio
 
-def pitch_resample(y: np.ndarray, n: float, orig_sr: int):
-    """Wrapper for librosa.resample"""
+def pitch_resample(y: np.ndarray, n: float, orig_sr: int, res_type: str = 'soxr_vhq', target_sr: int = None):
+    """Wrapper for librosa.resample
+    Pass target_sr to convert the sample rate in the same resample as the pitch shift"""
     # NOTE: Due to how soundfile shapes the data, vs how librosa does,
     #       we have to flip the shape before and after
+    import librosa # Slow to import, only loaded by pitched samples and effects
+
+    if target_sr is None:
+        target_sr = orig_sr
 
     # Flip n so range is -..+
     n = -n
@@ -115,20 +408,32 @@ def pitch_resample(y: np.ndarray, n: float, orig_sr: int):
     # Match librosa data shape to soundfile data shape
     y = y.transpose((1,0))
     # Resample data to reach desired pitch change
-    y_shifted = librosa.resample(y=y, orig_sr=orig_sr, target_sr=int(orig_sr*(factor**n)), res_type='soxr_vhq')
+    y_shifted = librosa.resample(y=y, orig_sr=orig_sr, target_sr=int(target_sr*(factor**n)), res_type=res_type)
     # Match librosa data shape to soundfile data shape
     y_shifted = y_shifted.transpose((1,0))
     
     return y_shifted
 
-def adjust_volume(wavdata,level_db):
-    """Adjust volume of audio by number of decibels"""
-    wavdata = np.multiply(wavdata, db_to_linear(level_db))
+def adjust_volume(wavdata,level_db,out=None):
+    """Adjust volume of audio by number of decibels
+    Pass out=wavdata to adjust in place"""
+    wavdata = np.multiply(wavdata, db_to_linear(level_db), out=out)
     return wavdata
 
 def compressor(data, threshold, ratio, attack_time, release_time, sample_rate=44100, gain=0):
     """Fixed attack and release times not implemented
     WIP - ChatGPT"""
+    return compressor_block(data, threshold, ratio, attack_time, release_time, sample_rate, gain)[0]
+
+def compressor_block(data, threshold, ratio, attack_time, release_time, sample_rate=44100, gain=0, envelope=None):
+    """compressor() for consecutive blocks of audio
+
+    Args:
+        envelope (ndarray): Envelope peak per channel returned for the previous block, None for the first
+
+    Returns:
+        (ndarray, ndarray): Compressed audio and the envelope peak to pass with the next block
+    """
     # Convert the threshold from dB to linear scale
     threshold = db_to_linear(threshold)
     gain = db_to_linear(gain)
@@ -138,13 +443,15 @@ def compressor(data, threshold, ratio, attack_time, release_time, sample_rate=44
     # Initialize the compressor state variables
     compressor_gain = 1.0
     compressor_envelope = 0.0
-    # Initialize an array to hold the output samples
-    output_data = np.zeros_like(data)
     # Compute the attack and release coefficients
-    attack_coeff = np.exp(-np.log(9) / attack_samples)
-    release_coeff = np.exp(-np.log(9) / release_samples)
+    attack_coeff = math.exp(-math.log(9) / attack_samples)
+    release_coeff = math.exp(-math.log(9) / release_samples)
+    # Continue from the envelope peak of the previous block
+    floor = compressor_envelope * attack_coeff if envelope is None else envelope
     # Compute the compressor envelope
-    compressor_envelope = np.maximum.accumulate(np.maximum(np.abs(data), compressor_envelope * attack_coeff))
+    compressor_envelope = np.maximum.accumulate(np.maximum(np.abs(data), floor))
+    if len(compressor_envelope):
+        envelope = compressor_envelope[-1].copy()
     compressor_envelope = np.where(compressor_envelope > threshold, compressor_envelope, compressor_envelope * release_coeff)
     # Compute the compressor gain
     compressor_gain = np.where(compressor_envelope > threshold, (1 + (compressor_envelope - threshold) * ratio) ** -1, 1.0)
@@ -153,39 +460,45 @@ def compressor(data, threshold, ratio, attack_time, release_time, sample_rate=44
     # Apply gain
     output_data = adjust_volume(output_data, gain)
     # Return the output data
-    return output_data
+    return output_data, envelope
 
-def normalize(audio, max_level=0):
-    """Normalize audio to max_level (decibel)"""
+def normalize(audio, max_level=0, out=None):
+    """Normalize audio to max_level (decibel)
+    Pass out=audio to normalize in place"""
     # Convert the maximum level from dB to linear scale
     max_level = db_to_linear(max_level)
-    # Calculate the maximum absolute value of the audio data
-    max_abs_val = np.max(np.abs(audio))
+    # Calculate the maximum absolute value of the audio data, without an abs() copy
+    max_abs_val = max(np.max(audio), -np.min(audio))
     # Normalize the audio data by dividing by the maximum absolute value and multiplying by the maximum level
-    normalized_audio = audio / max_abs_val * max_level
+    normalized_audio = np.divide(audio, max_abs_val, out=out)
+    np.multiply(normalized_audio, max_level, out=normalized_audio)
     return normalized_audio
 
-def hard_clip(audio: np.ndarray, threshold: float = 0, gain: float = 0):
-    """Apply a hard clip effect to any value above the threshold"""
+def hard_clip(audio: np.ndarray, threshold: float = 0, gain: float = 0, out = None):
+    """Apply a hard clip effect to any value above the threshold
+    Pass out=audio to clip in place"""
     # Convert the threshold from dB to linear scale
     threshold = db_to_linear(threshold)
-    hard_clipped_audio = np.clip(audio,-threshold, threshold)
+    hard_clipped_audio = np.clip(audio,-threshold, threshold, out=out)
     # Apply gain
-    hard_clipped_audio = adjust_volume(hard_clipped_audio,gain)
+    hard_clipped_audio = adjust_volume(hard_clipped_audio,gain,out=hard_clipped_audio)
 
     return hard_clipped_audio
 
-def soft_clip(audio: np.ndarray, threshold: float = 0, gain: float = 0, auto_gain: bool = False):
-    """Apply a soft clip effect to any value above the threshold"""
+def soft_clip(audio: np.ndarray, threshold: float = 0, gain: float = 0, auto_gain: bool = False, out = None):
+    """Apply a soft clip effect to any value above the threshold
+    Pass out=audio to clip in place"""
     # Convert the threshold from dB to linear scale
     threshold = db_to_linear(threshold)
-    # Apply the soft clip effect to the audio data
-    soft_clipped_audio = np.tanh(audio / threshold) * threshold
+    # Apply the soft clip effect to the audio data, reusing a single buffer
+    soft_clipped_audio = np.divide(audio, threshold, out=out)
+    np.tanh(soft_clipped_audio, out=soft_clipped_audio)
+    np.multiply(soft_clipped_audio, threshold, out=soft_clipped_audio)
     # Apply gain
     if auto_gain:
-        soft_clipped_audio = normalize(soft_clipped_audio)
+        soft_clipped_audio = normalize(soft_clipped_audio, out=soft_clipped_audio)
     else:
-        soft_clipped_audio = adjust_volume(soft_clipped_audio, gain)
+        soft_clipped_audio = adjust_volume(soft_clipped_audio, gain, out=soft_clipped_audio)
     return soft_clipped_audio
 
 def inverse_hard_clip(data, threshold):
@@ -201,16 +514,8 @@ def inverse_hard_clip(data, threshold):
 
 def butterworth_filter_mono(data, filter_type, cutoff_frequencies, sample_rate, order):
     """Butterworth filter implementation using scipy.signal"""
-    # Compute the Nyquist frequency
-    nyquist_frequency = sample_rate / 2
-    # Normalize the cutoff frequencies to the Nyquist frequency
-    normalized_cutoff_frequencies = [cutoff / nyquist_frequency for cutoff in cutoff_frequencies]
-    # Compute the filter coefficients using the butter function from the scipy.signal module
-    b, a = scipy.signal.butter(order, normalized_cutoff_frequencies, filter_type)
-    # Use lfilter to apply the filter
-    filtered_data = scipy.signal.lfilter(b, a, data)
-    # Return the filtered data
-    return filtered_data
+    sos = filters.design(filter_type, cutoff_frequencies, order, sample_rate)
+    return filters.sos_filter(data, sos)[0]
 
 def butterworth_filter(data, filter_type, cutoff_frequency, order, sample_rate = 44100):
     """Applies a Butterworth filter to the audio.
@@ -226,17 +531,6 @@ def butterworth_filter(data, filter_type, cutoff_frequency, order, sample_rate =
     Returns:
         filtered_data: filtered audio
     """
-    # If scalar, convert to list
-    if type(cutoff_frequency) ==  int:
-        cutoff_frequency = [cutoff_frequency]
-    # Split the audio data into left and right channels
-    left_channel = data[:, 0]
-    right_channel = data[:, 1]
-    # Apply the Butterworth filter to the left channel
-    left_filtered = butterworth_filter_mono(left_channel, filter_type, cutoff_frequency, sample_rate, order)
-    # Apply the Butterworth filter to the right channel
-    right_filtered = butterworth_filter_mono(right_channel, filter_type, cutoff_frequency, sample_rate, order)
-    # Combine the filtered left and right channels into stereo audio
-    filtered_data = np.column_stack((left_filtered, right_filtered))
-    # Return the filtered data
-    return filtered_data
\ No newline at end of file
+    # Both channels are filtered in one pass, with coefficients designed once
+    sos = filters.design(filter_type, cutoff_frequency, order, sample_rate)
+    return filters.sos_filter(data, sos)[0]
@@ -0,0 +1,121 @@
+import math
+import functools
+from typing import Optional, Union
+
+import numpy as np
+
+# Butterworth types and their scipy names
+BUTTERWORTH_TYPES = {
+    'low': 'lowpass',
+    'lowpass': 'lowpass',
+    'high': 'highpass',
+    'highpass': 'highpass',
+    'band': 'bandpass',
+    'bandpass': 'bandpass',
+    'bandstop': 'bandstop',
+}
+
+# Single biquad EQ types (RBJ audio EQ cookbook)
+EQ_TYPES = ('lowshelf', 'highshelf', 'peak')
+
+def design(
+        filter_type: str,
+        cutoff: Union[float, tuple],
+        order: int = 4,
+        sr: int = 44100,
+        gain: float = 0,
+        q: float = 1 / math.sqrt(2)
+    ) -> np.ndarray:
+    """Second-order sections of a filter, designed once per set of arguments
+
+    Args:
+        filter_type (str): 'low', 'high', 'band', 'bandstop' (Butterworth),
+            or 'lowshelf', 'highshelf', 'peak' (biquad EQ)
+        cutoff (float or list): Cutoff frequency in Hz, two for 'band' and 'bandstop'
+        order (int): Butterworth order, ignored by EQ types
+        sr (int): Sample rate
+        gain (float): EQ gain in dB, ignored by Butterworth types
+        q (float): EQ quality factor, ignored by Butterworth types
+
+    Returns:
+        ndarray: (n_sections, 6) array for scipy.signal.sosfilt, shared by all callers
+    """
+    # Lists are not hashable, so cannot be cached as is
+    cutoff = tuple(float(c) for c in cutoff) if np.ndim(cutoff) else float(cutoff)
+    return _design(filter_type, cutoff, int(order), int(sr), float(gain), float(q))
+
+@functools.lru_cache(maxsize=256)
+def _design(filter_type: str, cutoff, order: int, sr: int, gain: float, q: float) -> np.ndarray:
+    import scipy.signal # Slow to import, only loaded once a filter is used
+    nyquist = sr / 2
+    for frequency in np.atleast_1d(cutoff):
+        if not 0 < frequency < nyquist:
+            raise ValueError(f'Cutoff {frequency} Hz must be between 0 and {nyquist} Hz')
+
+    if filter_type in BUTTERWORTH_TYPES:
+        btype = BUTTERWORTH_TYPES[filter_type]
+        if btype in ('bandpass', 'bandstop') and np.ndim(cutoff) != 1:
+            raise ValueError(f"'{filter_type}' filters need a low and a high cutoff")
+        if btype in ('lowpass', 'highpass') and np.ndim(cutoff):
+            cutoff, = cutoff
+        sos = scipy.signal.butter(order, cutoff, btype, fs=sr, output='sos')
+    elif filter_type in EQ_TYPES:
+        sos = biquad(filter_type, cutoff, sr, gain, q)[np.newaxis]
+    else:
+        raise ValueError(f'Unknown filter type {filter_type!r}')
+    return sos
+
+def biquad(filter_type: str, frequency: float, sr: int, gain: float = 0, q: float = 1 / math.sqrt(2)) -> np.ndarray:
+    """Shelving or peaking EQ section from the RBJ audio EQ cookbook
+
+    Returns:
+        ndarray: Normalized section b0, b1, b2, 1, a1, a2
+    """
+    A = 10 ** (gain / 40)
+    w0 = 2 * math.pi * frequency / sr
+    cos = math.cos(w0)
+    alpha = math.sin(w0) / (2 * q)
+    if filter_type == 'peak':
+        b = [1 + alpha * A, -2 * cos, 1 - alpha * A]
+        a = [1 + alpha / A, -2 * cos, 1 - alpha / A]
+    elif filter_type == 'lowshelf':
+        root = 2 * math.sqrt(A) * alpha
+        b = [A * ((A + 1) - (A - 1) * cos + root), 2 * A * ((A - 1) - (A + 1) * cos), A * ((A + 1) - (A - 1) * cos - root)]
+        a = [(A + 1) + (A - 1) * cos + root, -2 * ((A - 1) + (A + 1) * cos), (A + 1) + (A - 1) * cos - root]
+    elif filter_type == 'highshelf':
+        root = 2 * math.sqrt(A) * alpha
+        b = [A * ((A + 1) + (A - 1) * cos + root), -2 * A * ((A - 1) + (A + 1) * cos), A * ((A + 1) + (A - 1) * cos - root)]
+        a = [(A + 1) - (A - 1) * cos + root, 2 * ((A - 1) - (A + 1) * cos), (A + 1) - (A - 1) * cos - root]
+    else:
+        raise ValueError(f'Unknown EQ type {filter_type!r}')
+    return np.array(b + a) / a[0]
+
+def sos_filter(
+        audio: np.ndarray,
+        sos: np.ndarray,
+        zi: Optional[np.ndarray] = None,
+        zero_phase: bool = False
+    ) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """Filter all channels at once along time
+
+    Args:
+        audio (ndarray): Audio data, time along axis 0
+        sos (ndarray): Second-order sections, see design()
+        zi (ndarray): Filter state returned for the previous block, None for the first
+        zero_phase (bool): Filter forwards and backwards (sosfiltfilt), whole buffers only
+
+    Returns:
+        (ndarray, ndarray): Filtered audio in the input dtype, and the state to pass with the next block
+    """
+    import scipy.signal
+    if zero_phase:
+        if len(audio) <= 3 * (2 * len(sos) + 1):
+            # Too short for sosfiltfilt padding
+            filtered = scipy.signal.sosfiltfilt(sos, audio, axis=0, padlen=0)
+        else:
+            filtered = scipy.signal.sosfiltfilt(sos, audio, axis=0)
+        return filtered.astype(audio.dtype, copy=False), None
+    if zi is None:
+        zi = np.zeros((len(sos), 2) + audio.shape[1:])
+    filtered, zi = scipy.signal.sosfilt(sos, audio, axis=0, zi=zi)
+    return filtered.astype(audio.dtype, copy=False), zi
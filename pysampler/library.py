@@ -1,22 +1,26 @@
+import os
 import random
-import glob
 import json
-from colorama import init, Fore, Style
+from typing import Optional
 
-init(autoreset=True)
+import soundfile as sf
+
+from .util import Fore, Style
+
+INDEX_VERSION = 1
 
 class Library:
     """Sample Library class which provides functions to reference samples.
     Loads sample folder paths from JSON into a dict with sample types as keys
-    
+
     Example JSON structure:
     {
-        "kicks": 
+        "kicks":
         [
             "samples/kicks",
             "other_samples/kicks2"
         ],
-        "snares": 
+        "snares":
         [
             "samples/snares",
             "other_samples/snares2"
@@ -27,24 +31,153 @@ class Library:
             "other_samples/hihats2"
         ]
     }
+
+    Folders are scanned once into an index of .wav files with their size,
+    mtime, duration, sample rate and channels. If index_path is specified the
+    index is saved there and loaded by later Library objects instead of
+    scanning again. Call refresh() to pick up changes to the folders, only
+    new or modified files are read again.
     """
 
-    def __init__(self, path: str = 'lib.json') -> None:
+    def __init__(self, path: str = 'lib.json', index_path: Optional[str] = None) -> None:
         with open(path) as f:
             self.samples = json.load(f)
+        self.index_path = index_path
+        self.index: dict[str, list[dict]] = {} # Entries by folder
+        self._queries: dict[tuple, list[str]] = {}
+
+        if index_path is not None and os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                self.index = index['folders']
+
+    def refresh(self, folders: Optional[list[str]] = None) -> None:
+        """Rescan folders (default all library folders) and save the index
+        Files with unchanged size and mtime keep their existing entry"""
+        if folders is None:
+            folders = [folder for type_folders in self.samples.values() for folder in type_folders]
+        for folder in folders:
+            self.index[folder] = scan_folder(folder, self.index.get(folder, []))
+        self._queries = {}
+        self.save()
+
+    def save(self) -> None:
+        """Save the index to index_path, if specified"""
+        if self.index_path is None:
+            return
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'folders': self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _folder_entries(self, folder: str) -> list[dict]:
+        """Returns the index entries of a folder, scanning it if not indexed yet"""
+        if folder not in self.index:
+            self.refresh([folder])
+        return self.index[folder]
 
-    def random_by_type(self, type: str, print_selection: bool = True):
-        """Get a random .wav sample path by type of sample"""
-        folder = random.choice(self.samples[type])
-        options = glob.glob(f'{folder}/**/*.wav', recursive=True)
-        options += (glob.glob(f'{folder}/**/*.WAV', recursive=True)) # Fix for case sensitivity
-        path = random.choice(options)
+    def query(
+            self,
+            type: str,
+            min_duration: Optional[float] = None,
+            max_duration: Optional[float] = None,
+            sr: Optional[int] = None,
+            channels: Optional[int] = None
+        ) -> list[dict]:
+        """Get index entries of a sample type matching all specified filters
+
+        Args:
+            type (str): Sample type, as in the library JSON
+            min_duration (float): Minimum duration in seconds
+            max_duration (float): Maximum duration in seconds
+            sr (int): Sample rate
+            channels (int): Number of channels
+
+        Returns:
+            list[dict]: Entries with path, size, mtime, duration, sr and channels
+        """
+        entries = []
+        for folder in self.samples[type]:
+            for entry in self._folder_entries(folder):
+                if min_duration is not None and entry['duration'] < min_duration:
+                    continue
+                if max_duration is not None and entry['duration'] > max_duration:
+                    continue
+                if sr is not None and entry['sr'] != sr:
+                    continue
+                if channels is not None and entry['channels'] != channels:
+                    continue
+                entries.append(entry)
+        return entries
+
+    def random_by_type(self, type: str, print_selection: bool = True, **filters):
+        """Get a random .wav sample path by type of sample
+
+        Without filters a random folder is picked, then a random sample in it.
+        With filters (see query) a random sample is picked among all matches.
+        """
+        if filters:
+            key = (type,) + tuple(sorted(filters.items()))
+            if key not in self._queries:
+                self._queries[key] = [entry['path'] for entry in self.query(type, **filters)]
+            options = self._queries[key]
+            if not options:
+                raise ValueError(f'No {type} samples match {filters}')
+            path = random.choice(options)
+        else:
+            folder = random.choice(self.samples[type])
+            path = random.choice(self._folder_entries(folder))['path']
         if print_selection:
             print(f'{Fore.MAGENTA}> 🔉 Sample: {Style.BRIGHT}{path}')
         return path
 
     def rand_sample_from_folder(self, path: str):
         """Get a random .wav sample path from a folder"""
-        options = glob.glob(f'{path}/**/*.wav', recursive=True)
-        file = random.choice(options)
-        return file
\ No newline at end of file
+        return random.choice(self._folder_entries(path))['path']
+
+def scan_folder(folder: str, entries: Optional[list[dict]] = None) -> list[dict]:
+    """Recursively index the .wav files of a folder, sorted by path
+
+    Args:
+        folder (str): Folder to scan
+        entries (list[dict]): Previous entries, reused for files with unchanged size and mtime
+
+    Returns:
+        list[dict]: Entries with path, size, mtime, duration, sr and channels
+    """
+    previous = {entry['path']: entry for entry in entries or []}
+    scanned = []
+    stack = [folder]
+    while stack:
+        try:
+            items = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with items:
+            for item in items:
+                if item.name.startswith('.'):
+                    continue
+                if item.is_dir():
+                    stack.append(item.path)
+                    continue
+                if os.path.splitext(item.name)[1].lower() != '.wav':
+                    continue
+                stat = item.stat()
+                entry = previous.get(item.path)
+                if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                    try:
+                        info = sf.info(item.path)
+                    except RuntimeError:
+                        continue # Not readable by soundfile
+                    entry = {
+                        'path': item.path,
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime_ns,
+                        'duration': info.duration,
+                        'sr': info.samplerate,
+                        'channels': info.channels
+                    }
+                scanned.append(entry)
+    scanned.sort(key=lambda entry: entry['path'])
+    return scanned
@@ -0,0 +1,276 @@
+import numpy as np
+
+from .scheduler import EventList
+from .util import db_to_linear, has_module, lazy_jit
+
+def _mix_kernel(canvas, data, onsets, lengths, gains, indices, offset, monophonic, ramp):
+    """Scale and add (or write, if monophonic) the given events of one buffer onto the canvas
+    The buffer is mono or has the channels of the canvas
+    Monophonic events fade out with the ramp, their length must be at least the ramp's"""
+    end = offset + canvas.shape[0]
+    fade = ramp.shape[0]
+    channels = canvas.shape[1]
+    same_channels = data.shape[1] == channels
+    # Frames are contiguous rows, so matching buffers are mixed as flat runs of samples
+    target = canvas.reshape(-1)
+    source = data.reshape(-1)
+    for i in indices:
+        onset = onsets[i]
+        length = lengths[i]
+        gain = gains[i]
+        src_start = max(max(offset, 0), onset) - onset
+        src_end = min(end, onset + length) - onset
+        dst = (onset - offset) * channels
+        fade_start = min(max(src_start, length - fade), src_end) if monophonic else src_end
+        if same_channels:
+            if monophonic:
+                for k in range(src_start * channels, fade_start * channels):
+                    target[dst + k] = source[k] * gain
+            else:
+                for k in range(src_start * channels, src_end * channels):
+                    target[dst + k] += source[k] * gain
+        else:
+            # Mono buffer into a multichannel canvas
+            for j in range(src_start, fade_start):
+                x = source[j] * gain
+                for c in range(channels):
+                    if monophonic:
+                        target[dst + j * channels + c] = x
+                    else:
+                        target[dst + j * channels + c] += x
+        for j in range(fade_start, src_end):
+            for c in range(channels):
+                x = source[j * data.shape[1] + (c if same_channels else 0)] * gain * ramp[j - (length - fade)]
+                target[dst + j * channels + c] = x
+
+# Without numba, events are mixed one at a time with NumPy
+mix_kernel = lazy_jit(_mix_kernel) if has_module('numba') else None
+
+class Layer:
+    """Events of a track bound to the (pitched) data of one of its samples
+
+    Pitched buffers are looked up once per distinct pitch, after which any
+    window of the sequence can be mixed, so the same layer serves a whole
+    sequence canvas or a stream of fixed-size blocks.
+    """
+
+    def __init__(
+            self,
+            events: EventList,
+            sample,
+            resample_cache,
+            monophonic: bool = False,
+            seq_len_samples: int = 0,
+            sr: int = 44100,
+            dtype = np.float64
+        ) -> None:
+        """
+        Args:
+            events (EventList): Compiled events of the track
+            sample (Sample): Sample layer to paste
+            resample_cache (ResampleCache): Source of pitched and sample rate converted data
+            monophonic (bool): Truncate each event at the next one instead of overlapping
+            seq_len_samples (int): Length of sequence in samples
+            sr (int): Sample rate
+            dtype: np.float64 or np.float32, precision of sample data and gains
+        """
+        self.events = events
+        self.monophonic = monophonic
+        # Mapped and lazy samples are normalized by their gain
+        self.gains = (db_to_linear(events.vol + sample.vol) * sample.gain).astype(dtype)
+
+        # Resample once per distinct pitch, converting samples recorded at another rate
+        pitches, self.buffer_index = np.unique(sample.pitch + events.pitch, return_inverse=True)
+        self.buffers = []
+        for n in pitches:
+            if n == 0 and sample.sr == sr:
+                self.buffers.append(sample.get_data(dtype))
+            else:
+                self.buffers.append(resample_cache.resample(sample, float(n), dtype, sr))
+
+        # Samples until the end of the sequence, the end of the sample or the next step
+        wav_lens = np.array([buffer.shape[0] for buffer in self.buffers], dtype=np.int64)
+        self.lengths = np.minimum(wav_lens[self.buffer_index], seq_len_samples - events.onset)
+        if monophonic:
+            self.lengths = np.minimum(self.lengths, events.length)
+        self.ends = events.onset + self.lengths
+
+        # Avoid hard clips when a monophonic sample restarts
+        self.fade_len = int(sr * (1/60))
+
+        # Event columns as Python lists, and buffers reused while mixing
+        self._onsets = events.onset.tolist()
+        self._lengths = self.lengths.tolist()
+        self._buffer_index = self.buffer_index.tolist()
+        self._scratches = {}
+        self._ramps = {}
+
+    def mix(self, canvas: np.ndarray, offset: int = 0) -> np.ndarray:
+        """Paste the sample onto the canvas for every event
+
+        Args:
+            canvas (ndarray): Stereo canvas to mix into, modified in place
+            offset (int): Position of the canvas in the sequence, in samples
+
+        Returns:
+            ndarray: The canvas
+        """
+        end = offset + canvas.shape[0]
+        onsets = self.events.onset
+        # Only visit events which sound inside this window
+        return self._mix_events(canvas, offset, np.flatnonzero((onsets < end) & (self.ends > offset) & (self.lengths > 0)))
+
+    def mix_segments(self, canvas: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """Paste the sample onto a whole sequence canvas, mixing each distinct segment once
+
+        Events are grouped by the segment (eg. bar, or pattern instance) they
+        start in. Segments with the same events relative to their start, with
+        the same lengths, pitches and gains, sound the same, so each distinct
+        segment is mixed once along with its tails, then added wherever it
+        repeats. Events only line up when segments fall on whole samples (eg.
+        bars at 120 bpm and 44.1 kHz), otherwise steps land one sample apart
+        from bar to bar. Falls back to mix() unless repeats at least halve the
+        segments to mix.
+
+        Args:
+            canvas (ndarray): Stereo canvas of the whole sequence, modified in place
+            starts (ndarray): Sorted start of every segment in samples
+
+        Returns:
+            ndarray: The canvas
+        """
+        n_segments = len(starts)
+        active = np.flatnonzero((self.events.onset < canvas.shape[0]) & (self.lengths > 0))
+        segment = np.maximum(np.searchsorted(starts, self.events.onset[active], side='right') - 1, 0)
+        order = np.argsort(segment, kind='stable')
+        active, segment = active[order], segment[order]
+        bounds = np.searchsorted(segment, np.arange(n_segments + 1))
+
+        # Segments by what they sound like: {signature: (events of the first one, starts of all)}
+        groups = {}
+        for index in range(n_segments):
+            events = active[bounds[index] : bounds[index+1]]
+            if len(events) == 0:
+                continue
+            signature = (
+                (self.events.onset[events] - starts[index]).tobytes(),
+                self.lengths[events].tobytes(),
+                self.buffer_index[events].tobytes(),
+                self.gains[events].tobytes()
+            )
+            group = groups.setdefault(signature, (events, []))
+            group[1].append(starts[index])
+        if 2 * len(groups) > np.count_nonzero(np.diff(bounds)):
+            return self.mix(canvas)
+
+        for events, segment_starts in groups.values():
+            # Mix the segment once with its tails, then overlap-add every repeat
+            start = segment_starts[0]
+            extent = int(np.max(self.ends[events])) - start
+            buffer = self._mix_events(np.zeros((extent, canvas.shape[1]), dtype=canvas.dtype), start, events)
+            for start in segment_starts:
+                end = min(start + extent, canvas.shape[0])
+                canvas[start : end] += buffer[: end - start]
+        return canvas
+
+    def _mix_events(self, canvas: np.ndarray, offset: int, indices: np.ndarray) -> np.ndarray:
+        """Paste the given events onto a canvas positioned at offset
+
+        With numba, events of every in-memory buffer are scaled and added in a
+        single compiled loop. Otherwise (and for lazy samples, or monophonic
+        events shorter than their fade) each event is scaled into a scratch
+        buffer reused by all events of the layer and then added, so dense or
+        overlapping events allocate nothing.
+        """
+        if mix_kernel is not None and len(indices):
+            indices = self._mix_compiled(canvas, offset, indices)
+        end = offset + canvas.shape[0]
+        # Python ints are much faster to index and compare than NumPy scalars
+        onsets = self._onsets
+        lengths = self._lengths
+        buffer_index = self._buffer_index
+        for i in indices.tolist():
+            onset = onsets[i]
+            length = lengths[i]
+            data = self.buffers[buffer_index[i]]
+
+            # Part of the event inside the window, relative to the event onset
+            src_start = max(offset, 0, onset) - onset
+            src_end = min(end, onset + length) - onset
+            dst_start = onset + src_start - offset
+            dst_end = onset + src_end - offset
+
+            piece = np.multiply(data[src_start : src_end], self.gains[i], out=self._scratch(src_end - src_start, data))
+            if self.monophonic:
+                fade = min(self.fade_len, length)
+                fade_start = max(src_start, length - fade)
+                if src_end > fade_start:
+                    ramp = self._ramp(fade)[fade_start - (length - fade) : src_end - (length - fade)]
+                    piece[fade_start - src_start:] *= ramp[:, np.newaxis]
+                canvas[dst_start : dst_end] = piece
+            else:
+                canvas[dst_start : dst_end] += piece
+
+        return canvas
+
+    def _mix_compiled(self, canvas: np.ndarray, offset: int, indices: np.ndarray) -> np.ndarray:
+        """Mix events with mix_kernel, returns the events it can not mix"""
+        ramp = self._ramp(self.fade_len)
+        kernel = np.ones(len(indices), dtype=bool)
+        if self.monophonic:
+            kernel &= self.lengths[indices] >= self.fade_len
+        buffer_index = self.buffer_index[indices]
+        for b, data in enumerate(self.buffers):
+            if not (isinstance(data, np.ndarray) and data.flags.c_contiguous and canvas.flags.c_contiguous):
+                kernel &= buffer_index != b # Lazy frames, or strided arrays
+                continue
+            if data.shape[1] not in (1, canvas.shape[1]):
+                kernel &= buffer_index != b # The kernel only spreads mono, NumPy broadcasts the rest
+                continue
+            selected = indices[kernel & (buffer_index == b)]
+            if len(selected):
+                mix_kernel(canvas, np.asarray(data), self.events.onset, self.lengths, self.gains, selected, offset, self.monophonic, ramp)
+        return indices[~kernel]
+
+    def _scratch(self, n: int, data) -> np.ndarray:
+        """First n rows of the scratch buffer for scaled pieces of data, grown as needed"""
+        dtype = np.result_type(data.dtype, self.gains.dtype)
+        key = (data.shape[1], dtype)
+        scratch = self._scratches.get(key)
+        if scratch is None or len(scratch) < n:
+            size = max(n, 2 * len(scratch)) if scratch is not None else n
+            scratch = self._scratches[key] = np.empty((size, data.shape[1]), dtype=dtype)
+        return scratch[:n]
+
+    def _ramp(self, fade: int) -> np.ndarray:
+        """Fade out of a monophonic event, shared by all events of the same fade length"""
+        ramp = self._ramps.get(fade)
+        if ramp is None:
+            ramp = self._ramps[fade] = np.linspace(1.0, 0.0, fade)
+        return ramp
+
+def mix_layers(layers: list[Layer], canvas: np.ndarray, offset: int = 0, segments: np.ndarray = None) -> np.ndarray:
+    """Mix several layers onto the canvas
+
+    Layers after the first are mixed onto a scratch canvas and then added,
+    so monophonic layers never overwrite each other.
+    With segment starts, a canvas of the whole sequence is mixed with Layer.mix_segments.
+    """
+    def mix(layer, canvas):
+        if segments is not None and offset == 0:
+            layer.mix_segments(canvas, segments)
+        else:
+            layer.mix(canvas, offset)
+
+    scratch = None
+    for index, layer in enumerate(layers):
+        if index == 0:
+            mix(layer, canvas)
+            continue
+        if scratch is None:
+            scratch = np.zeros_like(canvas)
+        else:
+            scratch[:] = 0
+        mix(layer, scratch)
+        canvas += scratch
+    return canvas
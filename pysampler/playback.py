@@ -0,0 +1,374 @@
+import copy
+import time
+import threading
+
+import numpy as np
+
+from .mixer import Layer, mix_layers
+from .effects import adjust_volume, Effect, EffectChain
+from .util import db_to_linear
+from .sequencer import Sequencer, CHANNELS, apply_effects, chain_latency, _can_stream, _reset
+
+def _shift(buffer: np.ndarray, n: int, length: int) -> None:
+    """Move buffer[n:n+length] to the front, in runs which do not overlap so numpy needs no temporary"""
+    if not n:
+        return
+    for start in range(0, length, n):
+        end = min(start + n, length)
+        buffer[start:end] = buffer[start + n : end + n]
+
+class CallbackTime:
+    """Stand-in for the time argument sounddevice passes to callbacks"""
+
+    def __init__(self, currentTime: float, outputBufferDacTime: float) -> None:
+        self.currentTime = currentTime
+        self.outputBufferDacTime = outputBufferDacTime
+
+class Loop:
+    """Compiled events and layers of one pass of the sequence, with a snapshot
+    of the effects and volumes it plays with"""
+
+    def __init__(self, seq: Sequencer, sr: int) -> None:
+        events, self.length = seq.compile_events(sr)
+        if self.length == 0:
+            raise ValueError('Cannot play an empty sequence')
+        self.tracks = list(seq.tracks)
+        # Layers run for two loops, so sample tails ring into the next pass
+        self.layers = {
+            track: [Layer(events[index], sample, seq.resample_cache, track.monophonic, 2 * self.length, sr, seq.dtype) for sample in track.samples]
+            for index, track in enumerate(self.tracks)
+        }
+        # Edits of effects and volumes are heard from the next loop, like edits of the steps
+        self.clones = {}
+        self.effects = {track: [self._snapshot(effect) for effect in track.effects] for track in self.tracks}
+        self.master_effects = [self._snapshot(effect) for effect in seq.effects]
+        self.vols = {track: track.vol for track in self.tracks}
+
+        # Track latencies are evened out with delays, which adds the worst one to the output latency
+        self.latencies = {track: chain_latency(self.effects[track], sr) for track in self.tracks}
+        self.track_latency = max(self.latencies.values(), default=0)
+        self.master_latency = chain_latency(self.master_effects, sr)
+
+        # Sidechained effects, their key track, and how far their input runs behind the tracks
+        self.sidechains = [
+            (effect, seq._sidechain_track(effect.sidechain), 0)
+            for track in self.tracks for effect in self.effects[track] if getattr(effect, 'sidechain', None) is not None
+        ] + [
+            # Sequence effects run behind the delays which line up the tracks
+            (effect, seq._sidechain_track(effect.sidechain), self.track_latency)
+            for effect in self.master_effects if getattr(effect, 'sidechain', None) is not None
+        ]
+        # Frame played when the stream of each sidechained effect started, set by the player
+        self.starts = {}
+
+    def _snapshot(self, effect):
+        """Copy of a native effect, which later edits of its parameters do not reach
+        Plugins keep their parameters in the plugin and are played as they are"""
+        if not isinstance(effect, Effect):
+            return effect
+        clone = copy.copy(effect)
+        for name, value in vars(effect).items():
+            if not name.startswith('_'):
+                setattr(clone, name, copy.deepcopy(value))
+        if isinstance(effect, EffectChain):
+            clone.effects = [self._snapshot(child) for child in effect.effects]
+        self.clones[id(effect)] = (effect, clone)
+        return clone
+
+    def carry_state(self, previous: 'Loop') -> None:
+        """Continue the streams of effects which were already playing in the previous loop"""
+        for key, (effect, clone) in self.clones.items():
+            entry = previous.clones.get(key)
+            if entry is not None and entry[0] is effect:
+                clone._state = entry[1]._state
+                clone._skip = entry[1]._skip
+                if id(entry[1]) in previous.starts:
+                    self.starts[id(clone)] = previous.starts[id(entry[1])]
+
+class Delay:
+    """Delays a stream by a fixed number of frames, in a preallocated ring buffer
+
+    Blocks shorter than the frames asked for, from effects still dropping
+    their latency, are preceded by silence.
+    """
+
+    def __init__(self, frames: int, dtype) -> None:
+        self.buffer = np.zeros((frames, CHANNELS), dtype=dtype)
+        self.index = 0
+
+    def add(self, block: np.ndarray, out: np.ndarray) -> None:
+        """Add the delayed stream to out, block holding the last frames of the input"""
+        silence = len(out) - len(block)
+        if not len(self.buffer):
+            out[silence:] += block
+            return
+        start = 0
+        while start < len(out):
+            # Runs which neither wrap around the ring nor cross from silence to the block
+            end = min(start + len(self.buffer) - self.index, len(out), silence if start < silence else len(out))
+            ring = self.buffer[self.index : self.index + end - start]
+            out[start:end] += ring
+            if start < silence:
+                ring[:] = 0
+            else:
+                ring[:] = block[start - silence : end - silence]
+            self.index = (self.index + end - start) % len(self.buffer)
+            start = end
+
+class Player:
+    """Real-time looping playback of a Sequencer
+
+    Blocks are pulled by an audio callback, which mixes the layers of the
+    current loop, the tails of the previous one, and runs the track and
+    sequence effects block by block. The callback only mixes: events are
+    compiled and pitched samples fetched by update(), outside of the audio
+    thread, and the new loop starts at the next loop boundary, so edits
+    never cut a pass in half and effects keep their state.
+
+    Every callback is timed against its deadline (block_size / sr), a late
+    callback or a device underflow counts as an underrun. simulate() drives
+    the callback from a simulated clock, without an audio device.
+
+    Effects with latency (eg. Dynamics lookahead) can not be compensated
+    live: the other tracks are delayed to stay in time with the latest one,
+    which adds the latency of the tracks and of the sequence effects to the
+    output latency.
+
+    Note that 'lazy' samples read from disk in the audio callback, use
+    'memory' or 'mmap' samples for live playback.
+    """
+
+    def __init__(self, seq: Sequencer, sr: int = 44100, block_size: int = 256, gain: float = 0) -> None:
+        """
+        Args:
+            seq (Sequencer): Sequence to play, edit it and call update() to hear the changes
+            sr (int): Sample rate
+            block_size (int): Frames per callback, the block latency is block_size / sr
+            gain (float): Output gain in dB, the output is clipped to [-1, 1]
+        """
+        if block_size < 1:
+            raise ValueError('block_size must be at least 1 sample')
+        self.seq = seq
+        self.sr = sr
+        self.block_size = block_size
+        self.gain = gain
+        self.stream = None
+
+        self.position = 0 # Frames into the current loop
+        self.frames_played = 0
+        self.loops_played = 0
+        self.blocks = 0
+        self.underruns = 0
+        self.max_callback_time = 0.0
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self._tails = None
+        self._loop = None
+        self._buffers = None
+        self._delays = {}
+        self._keys = {}
+        self.update()
+        self._loop, self._pending = self._pending, None
+        self.reset()
+
+    @property
+    def latency(self) -> float:
+        """Block latency in seconds"""
+        return self.block_size / self.sr
+
+    def update(self) -> None:
+        """Compile the sequence as it is now, the next loop plays it
+        Call after editing steps, samples or effects of the sequence"""
+        effects = self.seq.effects + [effect for track in self.seq.tracks for effect in track.effects]
+        for effect in effects:
+            if not _can_stream(effect):
+                raise ValueError(f'{type(effect).__name__} cannot process audio in blocks')
+        loop = Loop(self.seq, self.sr)
+        with self._lock:
+            self._pending = loop
+
+    def reset(self) -> None:
+        """Rewind to the start of the loop, drop tails and effect state and reset counters"""
+        for effect in self._loop.master_effects + [effect for effects in self._loop.effects.values() for effect in effects]:
+            _reset(effect)
+        self._loop.starts.clear()
+        self.position = 0
+        self.frames_played = 0
+        self.loops_played = 0
+        self.blocks = 0
+        self.underruns = 0
+        self.max_callback_time = 0.0
+        self._tails = None
+        self._delays = {}
+        self._keys = {}
+
+    def _next_loop(self) -> None:
+        """Called at the loop boundary, switches to a pending loop if there is one"""
+        self._tails = self._loop
+        self.loops_played += 1
+        # Never wait on update() from the audio thread, a loop compiled meanwhile starts next time
+        if self._lock.acquire(blocking=False):
+            try:
+                if self._pending is not None:
+                    self._pending.carry_state(self._loop)
+                    self._loop, self._pending = self._pending, None
+            finally:
+                self._lock.release()
+
+    def _mix_track(self, track, canvas: np.ndarray) -> np.ndarray:
+        """Mix the dry layers of a track at the playhead, with the tails of the previous loop"""
+        canvas[:] = 0
+        layers = self._loop.layers.get(track)
+        if layers:
+            mix_layers(layers, canvas, self.position)
+        tails = self._tails.layers.get(track) if self._tails is not None else None
+        if tails and not tails[0].monophonic:
+            # Tails are added, so the previous loop is read one loop length further
+            for layer in tails:
+                layer.mix(canvas, self.position + self._tails.length)
+        return canvas
+
+    def _process_segment(self, out: np.ndarray) -> None:
+        """Mix and process frames which do not cross the loop boundary"""
+        n = len(out)
+        track_buffer = self._buffers[0][:n]
+        master = self._buffers[1][:n]
+        master[:] = 0
+
+        loop = self._loop
+        # Dry sidechain keys, positioned on the frames played so far. Effects behind latency
+        # read the key that far back, so it starts with the history of the last frames
+        history = loop.track_latency + loop.master_latency
+        keys = {}
+        for effect, track, offset in loop.sidechains:
+            if track not in keys:
+                keys[track] = self._key(track, history, n)
+            # Effects added by an update start their stream at the loop boundary
+            start = loop.starts.setdefault(id(effect), self.frames_played)
+            effect.set_key(keys[track], self.frames_played - start - history + offset)
+
+        for track in loop.tracks:
+            block = self._mix_track(track, track_buffer)
+            block = apply_effects(loop.effects[track], block, self.sr, stream=True, inplace=True)
+            block = adjust_volume(block, loop.vols[track], out=block)
+            delay = self._delays.get(track)
+            if delay is None or len(delay.buffer) != loop.track_latency - loop.latencies[track]:
+                delay = self._delays[track] = Delay(loop.track_latency - loop.latencies[track], block.dtype)
+            delay.add(block, master)
+
+        processed = apply_effects(loop.master_effects, master, self.sr, stream=True, inplace=True)
+        # The sequence effects may still be dropping their latency
+        silence = n - len(processed)
+        out[:silence] = 0
+        processed = np.multiply(processed, db_to_linear(self.gain), out=master[silence:])
+        np.clip(processed, -1, 1, out=out[silence:])
+
+    def _key(self, track, history: int, n: int) -> np.ndarray:
+        """Dry mix of a track keying a sidechain, after the last history frames of the previous segments"""
+        buffer, buffer_history, previous = self._keys.get(track, (None, 0, 0))
+        if buffer is None or buffer_history != history or len(buffer) < history + n:
+            # Silence before the start
+            buffer, previous = np.zeros((history + max(n, self.block_size), CHANNELS), dtype=self.seq.dtype), 0
+        _shift(buffer, previous, history)
+        self._keys[track] = (buffer, history, n)
+        self._mix_track(track, buffer[history : history + n])
+        return buffer[:history + n]
+
+    def process(self, frames: int) -> np.ndarray:
+        """Returns the next frames of the loop, advancing the playhead
+
+        Args:
+            frames (int): Number of frames
+
+        Returns:
+            ndarray: (frames, 2) float32 audio
+        """
+        out = np.empty((frames, CHANNELS), dtype=np.float32)
+        self._fill(out)
+        return out
+
+    def _fill(self, out: np.ndarray) -> None:
+        frames = len(out)
+        if self._buffers is None or len(self._buffers[0]) < frames:
+            self._buffers = [np.zeros((max(frames, self.block_size), CHANNELS), dtype=self.seq.dtype) for _ in range(2)]
+        start = 0
+        while start < frames:
+            n = min(frames - start, self._loop.length - self.position)
+            self._process_segment(out[start : start + n])
+            start += n
+            self.position += n
+            self.frames_played += n
+            if self.position >= self._loop.length:
+                self.position = 0
+                self._next_loop()
+
+    def callback(self, outdata: np.ndarray, frames: int, time_info = None, status = None) -> None:
+        """sounddevice.OutputStream callback, fills outdata with the next block"""
+        started = time.perf_counter()
+        if status is not None and getattr(status, 'output_underflow', False):
+            self.underruns += 1
+        self._fill(outdata)
+        elapsed = time.perf_counter() - started
+        self.blocks += 1
+        self.max_callback_time = max(self.max_callback_time, elapsed)
+        if elapsed > frames / self.sr:
+            self.underruns += 1 # Missed the deadline, the device would have run dry
+
+    def simulate(self, seconds: float, on_block = None) -> np.ndarray:
+        """Drive the callback from a simulated clock, as an audio device would
+
+        Args:
+            seconds (float): Length of playback to simulate
+            on_block (callable): Called with the player and the stream time before every block,
+                eg. to edit the sequence and call update() at a given time
+
+        Returns:
+            ndarray: The played audio
+        """
+        n_blocks = int(np.ceil(seconds * self.sr / self.block_size))
+        audio = np.empty((n_blocks * self.block_size, CHANNELS), dtype=np.float32)
+        for index in range(n_blocks):
+            now = index * self.latency
+            if on_block is not None:
+                on_block(self, now)
+            block = audio[index * self.block_size : (index + 1) * self.block_size]
+            self.callback(block, self.block_size, CallbackTime(now, now + self.latency))
+        return audio
+
+    def start(self, device = None) -> None:
+        """Start playback on an audio device, needs sounddevice (pip install sounddevice)"""
+        try:
+            import sounddevice
+        except ImportError as e:
+            raise ImportError('Playback needs sounddevice, install it with pip install sounddevice') from e
+        self.stop()
+        self.stream = sounddevice.OutputStream(
+            samplerate=self.sr,
+            blocksize=self.block_size,
+            channels=CHANNELS,
+            dtype='float32',
+            device=device,
+            latency=self.latency,
+            callback=self.callback
+        )
+        self.stream.start()
+
+    def stop(self) -> None:
+        """Stop playback on the audio device"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def stats(self) -> dict:
+        """Returns block counters, underruns and the worst callback time against the deadline"""
+        return {
+            'blocks': self.blocks,
+            'frames_played': self.frames_played,
+            'loops_played': self.loops_played,
+            'underruns': self.underruns,
+            'latency': self.latency,
+            'max_callback_time': self.max_callback_time,
+            'max_load': self.max_callback_time / self.latency
+        }
@@ -0,0 +1,114 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+class RenderReport:
+    """Timings and allocations of a single render
+
+    Attributes:
+        filename (str): Rendered file
+        total (float): Wall time of the whole render in seconds
+        stages (dict): Seconds per stage, summed over tracks
+        bytes (dict): Bytes allocated per stage
+        tracks (dict): Seconds per stage for each track name
+        effects (list[dict]): Track name (None for sequence effects), effect name and seconds of every effect
+        resample_hits (int): Resample cache hits
+        resample_misses (int): Resample cache misses
+    """
+
+    def __init__(self, filename: str = '') -> None:
+        self.filename = filename
+        self.total = 0.0
+        self.stages: dict[str, float] = {}
+        self.bytes: dict[str, int] = {}
+        self.tracks: dict[str, dict[str, float]] = {}
+        self.effects: list[dict] = []
+        self.resample_hits = 0
+        self.resample_misses = 0
+
+    def add(self, stage: str, seconds: float, track: Optional[str] = None, nbytes: int = 0) -> None:
+        """Add time and allocated bytes to a stage, and to a track if specified"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if nbytes:
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+        if track is not None:
+            track_stages = self.tracks.setdefault(track, {})
+            track_stages[stage] = track_stages.get(stage, 0.0) + seconds
+
+    def merge(self, other: 'RenderReport') -> None:
+        """Add the stages, effects and cache counters of another report (eg. from a worker process)"""
+        for stage, seconds in other.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for stage, nbytes in other.bytes.items():
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+        for track, stages in other.tracks.items():
+            track_stages = self.tracks.setdefault(track, {})
+            for stage, seconds in stages.items():
+                track_stages[stage] = track_stages.get(stage, 0.0) + seconds
+        self.effects.extend(other.effects)
+        self.resample_hits += other.resample_hits
+        self.resample_misses += other.resample_misses
+
+    def to_dict(self) -> dict:
+        return {
+            'filename': self.filename,
+            'total': self.total,
+            'stages': dict(self.stages),
+            'bytes': dict(self.bytes),
+            'tracks': {track: dict(stages) for track, stages in self.tracks.items()},
+            'effects': list(self.effects),
+            'resample_hits': self.resample_hits,
+            'resample_misses': self.resample_misses
+        }
+
+    def __str__(self) -> str:
+        lines = [f'Render report {self.filename}: {self.total*1000:.1f} ms']
+        for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+            mb = self.bytes.get(stage, 0) / 1024 ** 2
+            lines.append(f'  {stage:<12} {seconds*1000:10.1f} ms {mb:10.1f} MB')
+        for track, stages in self.tracks.items():
+            timings = ', '.join(f'{stage} {seconds*1000:.1f} ms' for stage, seconds in stages.items())
+            lines.append(f'  track {track}: {timings}')
+        for effect in self.effects:
+            lines.append(f'  effect {effect["effect"]} ({effect["track"] or "sequence"}): {effect["seconds"]*1000:.1f} ms')
+        lines.append(f'  resample cache: {self.resample_hits} hits, {self.resample_misses} misses')
+        return '\n'.join(lines)
+
+class Profiler:
+    """Collects stage timings into a RenderReport, safe to share between threads"""
+
+    def __init__(self, filename: str = '') -> None:
+        self.report = RenderReport(filename)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, track: Optional[str] = None, nbytes: int = 0):
+        """Time the code inside the with block as a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, track, nbytes)
+
+    def add(self, stage: str, seconds: float, track: Optional[str] = None, nbytes: int = 0) -> None:
+        with self._lock:
+            self.report.add(stage, seconds, track, nbytes)
+
+    def add_effect(self, effect, seconds: float, track: Optional[str] = None) -> None:
+        with self._lock:
+            self.report.effects.append({'track': track, 'effect': type(effect).__name__, 'seconds': seconds})
+
+class NullProfiler:
+    """Profiler which records nothing, used when profiling is off"""
+
+    def stage(self, name: str, track: Optional[str] = None, nbytes: int = 0):
+        return nullcontext()
+
+    def add(self, stage: str, seconds: float, track: Optional[str] = None, nbytes: int = 0) -> None:
+        pass
+
+    def add_effect(self, effect, seconds: float, track: Optional[str] = None) -> None:
+        pass
+
+NULL_PROFILER = NullProfiler()
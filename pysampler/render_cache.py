@@ -0,0 +1,149 @@
+import os
+import shutil
+import hashlib
+import threading
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from .effects import is_plugin
+from .util import params_digest
+
+class RenderCache:
+    """Disk cache of rendered files, keyed by Sequencer.fingerprint()
+
+    Every entry is a .wav file named after its fingerprint, so the cache can be
+    shared by several processes and survives restarts. Reading an entry
+    refreshes its mtime, and the least recently used entries are deleted once
+    the files exceed max_bytes.
+    """
+
+    def __init__(self, directory: str = '.render_cache', max_bytes: int = 1024 ** 3) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # Entries live on disk, an unpickled cache (eg. in a worker process) only needs the folder
+        state = self.__dict__.copy()
+        state.update(_lock=None, hits=0, misses=0)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def path(self, fingerprint: str) -> str:
+        """Returns the path of the entry for a fingerprint, whether it exists or not"""
+        return os.path.join(self.directory, f'{fingerprint}.wav')
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Returns the path of a cached render, or None on a miss"""
+        path = self.path(fingerprint)
+        try:
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def load(self, fingerprint: str) -> Optional[tuple[np.ndarray, int]]:
+        """Returns the audio data and sample rate of a cached render, or None on a miss"""
+        path = self.get(fingerprint)
+        if path is None:
+            return None
+        return sf.read(path)
+
+    def put(self, fingerprint: str, filename: str) -> str:
+        """Copy a rendered file into the cache and evict old entries
+
+        Returns:
+            str: Path of the new entry
+        """
+        path = self.path(fingerprint)
+        # Write next to the entry and rename, so readers never see partial files
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """Returns path, size and mtime of every entry, least recently used first"""
+        entries = []
+        with os.scandir(self.directory) as items:
+            for item in items:
+                if not item.name.endswith('.wav'):
+                    continue
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue # Evicted by another process
+                entries.append((item.path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache is within max_bytes"""
+        entries = self.entries()
+        nbytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+
+    def clear(self) -> None:
+        """Delete all entries and reset hit/miss counters"""
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and disk usage"""
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'nbytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
+
+def effect_fingerprint(effect) -> tuple:
+    """Effect type and parameters, stable across processes
+
+    Native effects are described by their attributes, pedalboard effects by
+    their properties, and VSTs by their saved state.
+    """
+    name = type(effect).__name__
+    if hasattr(effect, 'raw_state'):
+        # VST3Plugin and friends
+        return (name, getattr(effect, 'name', ''), hashlib.sha256(effect.raw_state).hexdigest())
+    if is_plugin(effect):
+        from pedalboard import Pedalboard # Already loaded, the effect is a pedalboard object
+        if isinstance(effect, Pedalboard):
+            return (name, tuple(effect_fingerprint(plugin) for plugin in effect))
+    try:
+        params = vars(effect)
+    except TypeError:
+        # Pedalboard plugins expose their parameters as properties
+        params = {
+            key: getattr(effect, key) for key in dir(type(effect))
+            if not key.startswith('_') and isinstance(getattr(type(effect), key), property)
+        }
+    return (name, params_digest(params))
@@ -1,24 +1,80 @@
-from .effects import normalize
-
-import soundfile as sf
 import numpy as np
 
+from .cache import sample_pool, load_mmap, LazyFrames
+
+SAMPLE_MODES = ('memory', 'mmap', 'lazy')
+
 class Sample:
-    """Main .wav sample class. Loads wav data using soundfile"""
+    """Main .wav sample class. Loads wav data using soundfile
+    
+    In 'memory' mode (the default), decoded data is normalized stereo, shared
+    through cache.sample_pool and read-only.
+    Long samples can use 'mmap', which maps a raw float32 .npy copy of the
+    file, or 'lazy', which reads frames from the file as they are mixed.
+    Both keep the file's channels (mono is (frames, 1), broadcast when
+    mixed) and normalize with the gain scalar instead of rewriting the data.
+    """
     # TODO: Allow for pitch sequence
-    def __init__(self, sample_path: str = '', pitch: float = 0, vol: float = 0) -> None:
+    def __init__(
+            self,
+            sample_path: str = '',
+            pitch: float = 0,
+            vol: float = 0,
+            mode: str = 'memory',
+            cache_dir = None
+        ) -> None:
+        """
+        Args:
+            sample_path (str): Path to .wav sample
+            pitch (float): Semitones
+            vol (float): Volume in dB
+            mode (str): 'memory', 'mmap' or 'lazy'
+            cache_dir (str): Folder of .npy copies in 'mmap' mode, defaults to .pysampler next to the sample
+        """
+        if mode not in SAMPLE_MODES:
+            raise ValueError(f'mode must be one of {SAMPLE_MODES}')
         self.vol = vol
         self.pitch = pitch
         self.path = sample_path
-        self.sample_data, self.sr = sf.read(file=sample_path)
-        
-        # Convert mono samples to stereo
-        # TODO: use always2d=True in sf.read instead (didnt work properly)
-        #   (try changing the shape of array)
-        if len(self.sample_data.shape) != 2:
-            stereo = np.asarray([self.sample_data, self.sample_data])
-            stereo = np.transpose(stereo)
-            self.sample_data = stereo
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self._load()
+
+    def _load(self) -> None:
+        if self.mode == 'memory':
+            # Decoded, normalized stereo data and the pool key used by other caches
+            self.sample_data, self.sr, self.key = sample_pool.load(self.path)
+            self.gain = 1.0
+            return
+        if self.mode == 'mmap':
+            self.sample_data, self.sr, self.key, peak = load_mmap(self.path, self.cache_dir)
+        else:
+            self.sample_data = LazyFrames(self.path)
+            self.sr = self.sample_data.sr
+            self.key = sample_pool.key(self.path)
+            # Read once per file version, like the peak saved with mmap copies
+            peak = sample_pool.peak(self.key, self.sample_data)
+        # Normalization gain, applied when mixing
+        self.gain = 1.0 / peak if peak > 0 else 1.0
+
+    def __getstate__(self) -> dict:
+        # Mapped and lazy samples are opened again after unpickling (eg. in worker processes)
+        state = self.__dict__.copy()
+        if self.mode != 'memory':
+            del state['sample_data']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.mode == 'mmap':
+            self._load()
+        elif self.mode == 'lazy':
+            # The gain came along, so the file is not read again
+            self.sample_data = LazyFrames(self.path)
 
-        # Normalize
-        self.sample_data = normalize(self.sample_data)
\ No newline at end of file
+    def get_data(self, dtype = np.float64):
+        """Sample data in the given precision, float32 data is decoded once and pooled
+        Mapped and lazy samples always return their float32 frames"""
+        if self.mode != 'memory' or self.sample_data.dtype == dtype:
+            return self.sample_data
+        return sample_pool.load(self.key[0], dtype)[0]
@@ -0,0 +1,70 @@
+import numpy as np
+
+class EventList:
+    """Gated steps of a single track compiled to NumPy arrays
+
+    Attributes:
+        onset (ndarray): Start of each event, in samples
+        length (ndarray): Samples until the next event, or until the end of the sequence
+        vol (ndarray): Sequence volume plus step velocity, in decibels
+        pitch (ndarray): Step pitch plus track pitch, in semitones
+        step (ndarray): Index of the step which triggered each event
+    """
+
+    def __init__(self, onset, length, vol, pitch, step) -> None:
+        self.onset = onset
+        self.length = length
+        self.vol = vol
+        self.pitch = pitch
+        self.step = step
+
+    def __len__(self) -> int:
+        return len(self.onset)
+
+def compile_events(tracks: list, bpm: float, grid: float, sr: int, vol: float = 0) -> tuple[list[EventList], int]:
+    """Compile the steps of all tracks to event lists in a single pass
+
+    Args:
+        tracks (list[Track]): Tracks to compile
+        bpm (float): Sequence tempo
+        grid (float): Sequence grid resolution
+        sr (int): Sample rate
+        vol (float): Sequence volume in dB scale
+
+    Returns:
+        (list[EventList], int): Event list per track and length of sequence in samples
+    """
+    step_len_beats = grid*4
+    step_len_samples = sr/(bpm/60)
+
+    # Length of sequence in samples
+    seq_len = max((len(track.steps) for track in tracks), default=0)
+    seq_len_samples = int(seq_len * step_len_samples * step_len_beats)
+
+    event_lists = []
+    for track in tracks:
+        steps = track.steps
+        step = np.flatnonzero(steps.gate)
+
+        # Time of each gated step
+        t = step + steps.swing[step] + steps.delay[step] + steps.humanize[step]
+        onset = (t * step_len_beats * step_len_samples).astype(np.int64)
+
+        # Each event lasts until the next one, the last one until the end of the sequence
+        length = np.empty_like(onset)
+        length[:-1] = np.diff(onset)
+        length[-1:] = seq_len_samples - onset[-1:]
+
+        # Convert 0-127 velocity to dbFS level
+        with np.errstate(divide='ignore'):
+            step_vol = 20 * np.log10(steps.vel[step] / 127)
+
+        event_lists.append(EventList(
+            onset = onset,
+            length = length,
+            vol = vol + step_vol,
+            pitch = steps.pitch[step] + track.pitch,
+            step = step
+        ))
+
+    return event_lists, seq_len_samples
@@ -1,29 +1,284 @@
 import soundfile as sf
 import numpy as np
-import math
+import io
 import os
-from typing import Optional
-from colorama import Fore, Back, Style, init
-import mido
-
-from pedalboard import VST3Plugin, Pedalboard
-
-from .effects import apply_fadein, apply_fadeout, pitch_resample, adjust_volume, normalize
+import time
+import json
+import shutil
+import hashlib
+import weakref
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional, Union
+
+from .effects import apply_fadein, apply_fadeout, adjust_volume, normalize, pad_end, Effect, EffectChain, is_plugin
+from .util import db_to_linear, Fore, Style
+from . import cache
+from .cache import ResampleCache
 from .sample import Sample
 from .track import Track
-from .step import Step
-
-init(autoreset=True) # For colorama
+from .scheduler import EventList, compile_events
+from .mixer import Layer, mix_layers
+from .profiling import Profiler, RenderReport, NULL_PROFILER
+from .render_cache import RenderCache, effect_fingerprint
+from .arrangement import Arrangement
+
+CHANNELS = 2 # Stereo
+
+# Bump when a change to the render pipeline changes its output, to invalidate render caches
+FINGERPRINT_VERSION = 4
+
+# Block sized buffers alive at once while streaming:
+# master, track, layer scratch, pasted piece and two effect outputs
+STREAM_BUFFERS = 6
+
+def stream_memory_bound(block_size: int, dtype = np.float64) -> int:
+    """Upper bound in bytes of the mixing buffers used by Sequencer.render_stream
+    (the last block may be up to twice block_size long).
+    Decoded and pitched samples come on top, but do not grow with song length."""
+    return 2 * block_size * STREAM_BUFFERS * CHANNELS * np.dtype(dtype).itemsize
+
+def _is_pedalboard(effect) -> bool:
+    # By module name, so pedalboard is only imported by users of VSTs
+    return is_plugin(effect)
+
+def _can_stream(effect) -> bool:
+    """Whether an effect gives the same result on consecutive blocks as on the whole audio"""
+    if _is_pedalboard(effect):
+        return True
+    return isinstance(effect, Effect) and effect.streams
+
+def _reset(effect) -> None:
+    """Start a new stream"""
+    if _is_pedalboard(effect) or isinstance(effect, Effect):
+        effect.reset()
+
+def apply_effects(
+        effects: list,
+        audio: np.ndarray,
+        sr: int,
+        stream: bool = False,
+        profiler = NULL_PROFILER,
+        track: Optional[str] = None,
+        inplace: bool = False
+    ) -> np.ndarray:
+    """Apply effects in order as an EffectChain, effects keep their state between blocks when streaming
+    With inplace, pointwise effects overwrite audio instead of allocating"""
+    def on_effect(effect, seconds, nbytes):
+        profiler.add('vst' if _is_pedalboard(effect) else 'effects', seconds, track, nbytes)
+        profiler.add_effect(effect, seconds, track)
+    return EffectChain(effects).run(audio, sr, stream, inplace, on_effect if profiler is not NULL_PROFILER else None)
+
+def apply_effects_blocks(
+        effects: list,
+        audio: np.ndarray,
+        sr: int,
+        block_size: Optional[int] = None,
+        profiler = NULL_PROFILER,
+        track: Optional[str] = None,
+        inplace: bool = False
+    ) -> np.ndarray:
+    """Apply effects to consecutive blocks of audio, so their temporaries stay block sized
+    Output is the same as apply_effects(). Chains which can not stream are applied whole.
+    With inplace, the output is written over audio"""
+    if block_size is None or len(audio) <= block_size or not all(_can_stream(effect) for effect in effects):
+        return apply_effects(effects, audio, sr, profiler=profiler, track=track, inplace=inplace)
+    for effect in effects:
+        _reset(effect)
+    latency = chain_latency(effects, sr)
+    output = audio if inplace else np.empty_like(audio)
+    written = 0
+    with profiler.stage('effects', track):
+        # The blocks after the end flush the latency with silence
+        for start in range(0, len(audio) + latency, block_size):
+            block = audio[start : start + block_size]
+            owned = inplace
+            if latency and start + block_size > len(audio):
+                block = pad_end(block, min(block_size, len(audio) + latency - start) - len(block))
+                owned = True
+            processed = apply_effects(effects, block, sr, stream=True, inplace=owned)
+            # Output lags the input until the latency is dropped, numpy handles the overlap when in place
+            if processed is not output[written : written + len(processed)]:
+                output[written : written + len(processed)] = processed
+            written += len(processed)
+    return output
+
+def chain_latency(effects: list, sr: int) -> int:
+    """Samples dropped by a chain of effects before its output lines up with its input"""
+    return EffectChain(effects).latency(sr)
+
+def render_track(
+        track: Track,
+        events: EventList,
+        seq_len_samples: int,
+        sr: int,
+        resample_cache: Optional[ResampleCache] = None,
+        stem_path: Optional[str] = None,
+        dtype = np.float64,
+        effect_block_size: Optional[int] = None,
+        segments: Optional[np.ndarray] = None,
+        profiler = NULL_PROFILER
+    ) -> np.ndarray:
+    """Mix all sample layers of a track, then apply track effects and volume
+    Defined at module level so tracks can be rendered in a thread or process pool
+
+    Args:
+        track (Track): Track to render
+        events (EventList): Compiled events of the track
+        seq_len_samples (int): Length of sequence in samples
+        sr (int): Sample rate
+        resample_cache (ResampleCache): Source of pitched sample data, defaults to the shared cache
+        stem_path (str): Write the stem to this path if specified
+        dtype: np.float64 or np.float32, precision of the whole track render
+        effect_block_size (int): Apply effects in blocks of this many samples, whole track if None
+        segments (ndarray): Segment starts in samples, repeated segments are mixed once (see Layer.mix_segments)
+        profiler (Profiler): Records stage timings if specified
+
+    Returns:
+        ndarray: Rendered stem
+    """
+    if resample_cache is None:
+        resample_cache = cache.resample_cache
+    bytes_resampled = resample_cache.bytes_resampled
+    with profiler.stage('resample', track.name):
+        layers = [Layer(events, sample, resample_cache, track.monophonic, seq_len_samples, sr, dtype) for sample in track.samples]
+    profiler.add('resample', 0, track.name, resample_cache.bytes_resampled - bytes_resampled)
+
+    canvas_bytes = seq_len_samples * CHANNELS * np.dtype(dtype).itemsize
+    with profiler.stage('paste', track.name, canvas_bytes * min(len(layers), 2)):
+        wav_canvas = np.zeros((seq_len_samples, CHANNELS), dtype=dtype)
+        wav_canvas = mix_layers(layers, wav_canvas, segments=segments)
+
+    # The canvas is ours, so effects and volume may work in place
+    wav_canvas = apply_effects_blocks(track.effects, wav_canvas, sr, effect_block_size, profiler, track.name, inplace=True)
+    with profiler.stage('volume', track.name):
+        wav_canvas = adjust_volume(wav_canvas, track.vol, out=wav_canvas)
+
+    if stem_path is not None:
+        with profiler.stage('write', track.name):
+            sf.write(stem_path, wav_canvas, sr, 'PCM_24')
+    return wav_canvas
+
+def _render_track_profiled(*job) -> tuple[np.ndarray, RenderReport]:
+    """Render a track in a worker process, returning the stem and the worker's report"""
+    profiler = Profiler()
+    hits, misses = cache.resample_cache.hits, cache.resample_cache.misses
+    stem = render_track(*job, profiler=profiler)
+    profiler.report.resample_hits = cache.resample_cache.hits - hits
+    profiler.report.resample_misses = cache.resample_cache.misses - misses
+    return stem, profiler.report
 
 class Sequencer:
     """Sequencer class which contains Track objects, tempo and sample references"""
             
-    def __init__(self, bpm: float = 120, grid: float = 1/16) -> None:
+    def __init__(self, bpm: float = 120, grid: float = 1/16, dtype = np.float64) -> None:
+        """
+        Args:
+            bpm (float): Tempo
+            grid (float): Step length in bars
+            dtype: np.float64, or np.float32 to halve the memory and bandwidth of renders
+        """
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError('dtype must be np.float32 or np.float64')
         self.bpm = bpm
+        self.dtype = np.dtype(dtype) # Precision of samples, canvases and effects
+        self.effect_block_size = None # Run effect chains in blocks of this many samples, see apply_effects_blocks
+        self.reuse_bars = True # Mix repeated bars of a track once, see Layer.mix_segments
+        self.arrangement: Optional[Arrangement] = None # Song timeline played instead of track steps
         self.tracks: list[Track] = []
         self.vol = 0
         self.effects = []
         self.grid = grid
+        self.resample_cache = cache.resample_cache
+        # Stems of the last incremental render, with the track state and render settings they were made from
+        self._stems: weakref.WeakKeyDictionary[Track, tuple[dict, tuple, np.ndarray]] = weakref.WeakKeyDictionary()
+
+    def __getstate__(self) -> dict:
+        # Unpickled sequencers (eg. in worker processes) use the shared cache of their own process
+        state = self.__dict__.copy()
+        if state['resample_cache'] is cache.resample_cache:
+            state['resample_cache'] = None
+        del state['_stems']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.resample_cache is None:
+            self.resample_cache = cache.resample_cache
+        self._stems = weakref.WeakKeyDictionary()
+
+    def dirty_tracks(self) -> dict[str, list[str]]:
+        """Tracks which would be rendered again by render(incremental=True)
+
+        Returns:
+            dict: Changed parts of the state (steps, samples, effects, vol, ...) by track name,
+                'all' for tracks without a cached stem
+        """
+        dirty = {}
+        for track in self.tracks:
+            cached = self._stems.get(track)
+            if cached is None:
+                dirty[track.name] = ['all']
+                continue
+            state = self._track_state(track)
+            changed = [part for part, value in state.items() if cached[0][part] != value]
+            if changed:
+                dirty[track.name] = changed
+        return dirty
+
+    def _track_state(self, track: Track) -> dict:
+        """Track state with its part of the arrangement, plus the state of tracks keying its sidechained effects"""
+        def arranged_state(track):
+            state = track.state()
+            if self.arrangement is not None:
+                state['arrangement'] = self.arrangement.track_digest(track.name)
+            return state
+        state = arranged_state(track)
+        names = [effect.sidechain for effect in track.effects if getattr(effect, 'sidechain', None) is not None]
+        if names:
+            state['sidechain'] = tuple(arranged_state(self._sidechain_track(name)) for name in names)
+        return state
+
+    def _sidechain_track(self, name: str) -> Track:
+        track = self.tr(name)
+        if track is None:
+            raise ValueError(f'Sidechain track {name!r} is not in the sequence')
+        return track
+
+    def _set_sidechain_keys(self, layers_of: Callable[[int], list[Layer]], length: int, offset: int = 0) -> None:
+        """Mix the dry layers of every track keying a sidechain, and pass the keys to the effects
+
+        Args:
+            layers_of (callable): Returns the layers of a track index
+            length (int): Length of the keys in samples
+            offset (int): Position of the keys in the sequence, in samples
+        """
+        keys = {}
+        for effect in self.effects + [effect for track in self.tracks for effect in track.effects]:
+            name = getattr(effect, 'sidechain', None)
+            if name is None:
+                continue
+            if name not in keys:
+                index = self.tracks.index(self._sidechain_track(name))
+                keys[name] = mix_layers(layers_of(index), np.zeros((length, CHANNELS), dtype=self.dtype), offset)
+            effect.set_key(keys[name], offset)
+
+    def compile_events(self, sr: int) -> tuple[list[EventList], int]:
+        """Event list per track and length of sequence in samples, from the arrangement if there is one"""
+        if self.arrangement is not None:
+            return self.arrangement.compile_events(self.tracks, self.bpm, self.grid, sr, self.vol)
+        return compile_events(self.tracks, self.bpm, self.grid, sr, self.vol)
+
+    def _segments(self, sr: int, seq_len_samples: int) -> np.ndarray:
+        """Starts of the segments whose repeats are mixed once: pattern instances, or bars"""
+        if self.arrangement is not None:
+            return self.arrangement.segment_starts(self.bpm, self.grid, sr)
+        bar_len = 4 * sr / (self.bpm / 60)
+        return (np.arange(int(np.ceil(seq_len_samples / bar_len))) * bar_len).astype(np.int64)
+
+    def clear_stem_cache(self):
+        """Drop stems kept by incremental renders"""
+        self._stems = weakref.WeakKeyDictionary()
 
     def tr(self, name: str) -> Track:
         """Returns a track by name"""
@@ -77,7 +332,7 @@ class Sequencer:
             name (str): Name of the track
             steps (list[int]): Step sequence, 0 is off, 1 is on
             sample (str): Path to .wav sample
-            samples (list[dict]): Define multiple samples, optional pitch and volume params (see examples)
+            samples (list[dict]): Define multiple samples, optional pitch, volume and mode ('memory', 'mmap', 'lazy') params (see examples)
             delay (float): Delay all steps by a factor of 1 step
             vol (float): Track volume in dB scale
             swing (float): Shift every other step by a factor of 1 step
@@ -117,6 +372,8 @@ class Sequencer:
                 samples[i]['vol'] = 0
             if 'pitch' not in s.keys():
                 samples[i]['pitch'] = 0
+            if 'mode' not in s.keys():
+                samples[i]['mode'] = 'memory'
 
         # Create Track object
         track = Track(name)
@@ -129,7 +386,8 @@ class Sequencer:
             track.samples.append(Sample(
                 sample_path = sample['path'],
                 vol = sample['vol'],
-                pitch = sample['pitch']
+                pitch = sample['pitch'],
+                mode = sample['mode']
             ))
             
         track.pitch = track_pitch
@@ -203,189 +461,469 @@ class Sequencer:
     def add_effect(self, effect):
         self.effects.append(effect)
 
+    def fingerprint(self, sr: int = 44100, normalize_output: bool = True, seed: Optional[int] = None) -> str:
+        """Stable hash of everything that affects the rendered file
+
+        Covers bpm, grid, vol, sample rate, every step (including humanize
+        offsets already drawn), the arrangement, the contents of every sample file, effect
+        parameters and VST states. Equal fingerprints render to identical files,
+        in any process.
+
+        Args:
+            sr (int): Sample rate of the render
+            normalize_output (bool): If the render is normalized
+            seed (int): Seed used to generate the sequence, if it is to be part of the key
+
+        Returns:
+            str: Hex digest
+        """
+        tracks = []
+        for track in self.tracks:
+            tracks.append({
+                # Sidechained effects find their key track by name
+                'name': track.name,
+                'steps': track.steps.digest(),
+                'samples': [
+                    (cache.sample_pool.digest(sample.key), sample.mode, sample.sr, sample.vol, sample.pitch)
+                    for sample in track.samples
+                ],
+                'effects': [effect_fingerprint(effect) for effect in track.effects],
+                'vol': track.vol,
+                'pitch': track.pitch,
+                'monophonic': track.monophonic
+            })
+        state = {
+            'version': FINGERPRINT_VERSION,
+            'bpm': self.bpm,
+            'grid': self.grid,
+            'vol': self.vol,
+            'sr': sr,
+            'normalize_output': normalize_output,
+            'res_type': self.resample_cache.res_type,
+            'dtype': self.dtype.str,
+            'seed': seed,
+            'tracks': tracks,
+            'arrangement': self.arrangement.digest() if self.arrangement is not None else None,
+            'effects': [effect_fingerprint(effect) for effect in self.effects]
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=repr).encode()).hexdigest()
+
     def render(
             self, 
             filename: str = 'render.wav', 
             sr: int = 44100, 
             normalize_output: bool = True, 
             output_stems: bool = False,
-            verbose: bool = True
-        ):
+            verbose: bool = True,
+            workers: Optional[int] = None,
+            executor: str = 'thread',
+            profile: bool = False,
+            on_report: Optional[Callable[[RenderReport], None]] = None,
+            incremental: bool = False,
+            render_cache: Optional[RenderCache] = None
+        ) -> Optional[RenderReport]:
         """Render sequence to .wav file
 
+        Tracks are independent until the final mix, so they can be rendered
+        concurrently. The mix is summed in track order and is identical to a
+        serial render. With executor='process', tracks and their effects are
+        pickled to the worker processes, so VST effects are not supported, and
+        each process uses its own resample cache, with the settings of
+        Sequencer.resample_cache.
+
+        When profiling, the time and bytes allocated by every stage
+        (schedule, resample, paste, effects, vst, volume, mix, normalize, fade, write)
+        are recorded per track, along with effect durations and resample cache hits.
+
+        Incremental renders keep the stem of every track, and only render
+        tracks again when their state (steps, samples, effects, vol, pitch)
+        or the sequence timing changed. Stems are only written for those tracks.
+        VST parameter changes can not be detected, call track.mark_dirty() after them.
+
+        With a RenderCache, a render whose fingerprint is already cached is
+        copied from the cache instead. Stems are not cached, renders with
+        output_stems always run.
+
         Args:
             filename (str): Path to new audio file
             sr (int): Sample rate
             normalize (bool): If audio is to be normalized at the end
             output_stems (bool): Save track stems alongside new file
+            workers (int): Number of tracks rendered concurrently, serial if None
+            executor (str): 'thread' or 'process' pool
+            profile (bool): Record a RenderReport
+            on_report (callable): Called with the RenderReport when the render is done, implies profile
+            incremental (bool): Reuse stems of unchanged tracks from the last incremental render
+            render_cache (RenderCache): Cache of rendered files keyed by fingerprint
+
+        Returns:
+            RenderReport: if profiling, else None
         """
         if verbose:
             print(f'{Fore.CYAN}> Rendering sequence {Style.BRIGHT}{filename}')
-        # Initalize
-        stems = []
-        channels = 2 # Stereo
-        step_len_beats = self.grid*4
-        step_len_samples = sr/(self.bpm/60)
-
-        # Calculate length of sequence in samples
-        seq_len = 0
-        for track in self.tracks:
-            if len(track.steps) > seq_len:
-                seq_len = len(track.steps)
-        seq_len_samples = int(seq_len * step_len_samples * step_len_beats)
+        profiler = Profiler(filename) if profile or on_report is not None else NULL_PROFILER
+        render_start = time.perf_counter()
+        hits, misses = self.resample_cache.hits, self.resample_cache.misses
+
+        fingerprint = None
+        if render_cache is not None and not output_stems:
+            fingerprint = self.fingerprint(sr, normalize_output)
+            cached_path = render_cache.get(fingerprint)
+            if cached_path is not None:
+                with profiler.stage('write'):
+                    shutil.copyfile(cached_path, filename)
+                if verbose:
+                    print(f'{Fore.GREEN}✅ Render cached, file copied to {Fore.LIGHTGREEN_EX}{Style.BRIGHT}{filename}\n')
+                if profiler is NULL_PROFILER:
+                    return None
+                profiler.report.total = time.perf_counter() - render_start
+                if on_report is not None:
+                    on_report(profiler.report)
+                return profiler.report
+
+        wav_canvas, _ = self._render_mix(
+            sr, normalize_output, verbose, workers, executor, profiler, incremental,
+            stems_filename = filename if output_stems else None
+        )
 
-        # Calculate the time for each step V1
-        track_step_times = []
-        for track in self.tracks:
-            step_times = []
-            for step_index, step in enumerate(track.steps):
-                if step.gate:
-                    t = step_index + step.swing + step.delay + step.humanize
-                    t = int(t * step_len_beats * step_len_samples)
-                    step_times.append(t)
-                else:
-                    step_times.append(None)
-            track_step_times.append(step_times)
-
-        # Calculate sample length for all steps
-        track_step_lengths = []
-        for track_times in track_step_times:
-            step_lengths = [None] * len(track_times)
-            prev_step_index = 0
-            n1 = None
-            for i, step_time in enumerate(track_times):
-                if step_time is not None:
-                    if n1 is not None:
-                        step_lengths[prev_step_index] = step_time - n1
-                        n1 = None
-                    n1 = step_time
-                    prev_step_index = i
-                    # Check if its the last step..
-                    if i == len(track_times)-1:
-                        step_lengths[i] = 'last_step'
-                elif step_time is None and i == len(track_times)-1 and n1 is not None:
-                    step_lengths[prev_step_index] = 'last_step'
-            track_step_lengths.append(step_lengths)
+        # Save audio to .wav file using soundfile
+        with profiler.stage('write'):
+            sf.write(filename, wav_canvas, sr, 'PCM_24')
+        if fingerprint is not None:
+            render_cache.put(fingerprint, filename)
+
+        report = None
+        if profiler is not NULL_PROFILER:
+            report = profiler.report
+            report.total = time.perf_counter() - render_start
+            report.resample_hits += self.resample_cache.hits - hits
+            report.resample_misses += self.resample_cache.misses - misses
+            if on_report is not None:
+                on_report(report)
 
-        # Create and store stems for each track as waveform data
-        for t_index, track in enumerate(self.tracks):
-            if verbose:
-                print(f'\t{Fore.YELLOW}> {t_index+1}/{len(self.tracks)} - Rendering track: {Style.BRIGHT}{track.name}')
-            track_stems = []
-            sample: Sample
-            for sample in track.samples:
-                # Initialize wav_canvas
-                wav_canvas = np.zeros((seq_len_samples, channels), dtype = np.float64)
-                
-                # Copy sample to canvas when there is a positive gate
-                step: Step
-                for s_index, step in enumerate(track.steps):
-                    
-                    if step.gate:
-                        sample_time = track_step_times[t_index][s_index]
-                        # Get the sample data
-                        sample_data, sample_sr = sample.sample_data, sample.sr
-
-                        # Adjust pitch
-                        st = sample.pitch + step.pitch + track.pitch
-                        if st != 0:
-                            sample_data = pitch_resample(sample_data, st, orig_sr = sample_sr)
-
-                        # Convert 0-127 velocity to dbFS level
-                        if step.vel == 0:
-                            step.vol = -float('inf')
-                        else:
-                            step.vol = 20 * math.log10(step.vel / 127)
-                        
-                        # Adjust volume 
-                        volume_adjustment = self.vol + step.vol + sample.vol
-                        sample_data = adjust_volume(wavdata = sample_data, level_db = volume_adjustment)
-        
-                        # Get length of modified sample, in number of samples
-                        wav_len = sample_data.shape[0]
-                        step_len = track_step_lengths[t_index][s_index]
-
-                        # Calculate how many samples remain in our canvas
-                        time_left = seq_len_samples - sample_time
-
-                        # Checks and/or fix step length
-                        if step_len == 'last_step':
-                            step_len = wav_len
-                        if wav_len < step_len:
-                            step_len = wav_len
-                        if step_len > time_left:
-                            step_len = time_left
-
-                        # Copy sample to the canvas
-                        if track.monophonic:
-                            # Truncate sample to step length
-                            sample_data = sample_data[0 : step_len]
-                            # Avoid hard clips when sample restarts
-                            sample_data = apply_fadeout(sample_data,fadeout_duration=1/60)
-                            # Paste sample
-                            wav_canvas[sample_time : sample_time + step_len] = sample_data
-                        else:
-                            # Make sure we have time left, and then paste sample
-                            if wav_canvas[sample_time:sample_time + wav_len].shape[0] != 0:
-                                wav_canvas[sample_time:sample_time + wav_len] = np.add(
-                                    wav_canvas[sample_time:sample_time + wav_len], 
-                                    sample_data[0:time_left]
-                                )
-
-                # Copy the wav_canvas into our list of stems and repeat for each track
-                track_stems.append(wav_canvas)
-            
-            # Combine track stems, apply track effects, apply volume:
-            wav_canvas = np.zeros((seq_len_samples, channels),dtype=np.float64)
-            
-            for track_stem in track_stems:
-                wav_canvas += track_stem
-            
-            for effect in track.effects:
-                if isinstance(effect, VST3Plugin) or isinstance(effect, Pedalboard):
-                    wav_canvas = effect.process(wav_canvas, sr)
-                else:
-                    wav_canvas = effect.process(wav_canvas)
+        if verbose:
+            print(f'{Fore.GREEN}✅ Render complete, file saved as {Fore.LIGHTGREEN_EX}{Style.BRIGHT}{filename}\n')
+        return report
+
+    def render_array(
+            self,
+            sr: int = 44100,
+            normalize_output: bool = True,
+            return_stems: bool = False,
+            verbose: bool = False,
+            workers: Optional[int] = None,
+            executor: str = 'thread',
+            incremental: bool = False
+        ) -> Union[np.ndarray, tuple[np.ndarray, dict[str, np.ndarray]]]:
+        """Render sequence to a NumPy array, without writing any file
+
+        Same mix as render(), before it is written as 24 bit PCM.
 
-            wav_canvas = adjust_volume(wav_canvas, track.vol)
+        Args:
+            sr (int): Sample rate
+            normalize_output (bool): If audio is to be normalized at the end
+            return_stems (bool): Also return the stem of every track
+            workers (int): Number of tracks rendered concurrently, serial if None
+            executor (str): 'thread' or 'process' pool
+            incremental (bool): Reuse stems of unchanged tracks from the last incremental render
+
+        Returns:
+            ndarray: Stereo mix in the sequencer dtype, and a dict of stems by track name if return_stems
+        """
+        wav_canvas, stems = self._render_mix(sr, normalize_output, verbose, workers, executor, NULL_PROFILER, incremental)
+        if return_stems:
+            return wav_canvas, {track.name: stem for track, stem in zip(self.tracks, stems)}
+        return wav_canvas
+
+    def render_bytes(
+            self,
+            format: str = 'WAV',
+            subtype: Optional[str] = None,
+            sr: int = 44100,
+            normalize_output: bool = True,
+            verbose: bool = False,
+            workers: Optional[int] = None,
+            executor: str = 'thread',
+            incremental: bool = False
+        ) -> bytes:
+        """Render sequence to an encoded audio file in memory, eg. to send over a socket
+
+        Args:
+            format (str): Any soundfile format: 'WAV', 'FLAC', 'OGG', ...
+            subtype (str): soundfile subtype, defaults to 24 bit PCM for WAV and FLAC
+            sr (int): Sample rate
+            normalize_output (bool): If audio is to be normalized at the end
+            workers (int): Number of tracks rendered concurrently, serial if None
+            executor (str): 'thread' or 'process' pool
+            incremental (bool): Reuse stems of unchanged tracks from the last incremental render
+
+        Returns:
+            bytes: Encoded audio
+        """
+        format = format.upper()
+        if subtype is None and format in ('WAV', 'FLAC'):
+            subtype = 'PCM_24'
+        wav_canvas = self.render_array(sr, normalize_output, False, verbose, workers, executor, incremental)
+        buffer = io.BytesIO()
+        sf.write(buffer, wav_canvas, sr, subtype, format=format)
+        return buffer.getvalue()
+
+    def _render_mix(
+            self,
+            sr: int,
+            normalize_output: bool,
+            verbose: bool,
+            workers: Optional[int],
+            executor: str,
+            profiler,
+            incremental: bool,
+            stems_filename: Optional[str] = None
+        ) -> tuple[np.ndarray, list[np.ndarray]]:
+        """Render all tracks and mix them, see render()
+
+        Returns:
+            (ndarray, list[ndarray]): Master mix and the stem of every track
+        """
+        # Compile the steps of all tracks to arrays of events
+        with profiler.stage('schedule'):
+            events, seq_len_samples = self.compile_events(sr)
+        canvas_bytes = seq_len_samples * CHANNELS * self.dtype.itemsize
+
+        # Dry mixes of the tracks keying sidechained effects, covering the silence which flushes effect latency
+        with profiler.stage('sidechain'):
+            master_latency = chain_latency(self.effects, sr)
+            self._set_sidechain_keys(
+                lambda index: [
+                    Layer(events[index], sample, self.resample_cache, self.tracks[index].monophonic, seq_len_samples, sr, self.dtype)
+                    for sample in self.tracks[index].samples
+                ],
+                seq_len_samples + max((chain_latency(track.effects, sr) + master_latency for track in self.tracks), default=0)
+            )
+
+        # Stems only depend on their track and on these settings
+        settings = (seq_len_samples, sr, self.bpm, self.grid, self.vol, self.resample_cache.res_type, self.dtype)
+        stems = [None] * len(self.tracks)
+        states = [None] * len(self.tracks)
 
-            if output_stems:
-                filename_path = os.path.dirname(filename)
-                filename_base = os.path.splitext(os.path.basename(filename))[0]
-                if not os.path.exists(os.path.join(filename_path, filename_base)):
-                    os.mkdir(f'{filename_path}/{filename_base}')
-                stem_path = os.path.join(filename_path, filename_base, f'{filename_base}_{track.name}.wav')
+        # Arguments to render_track for each track to render
+        segments = self._segments(sr, seq_len_samples) if self.reuse_bars else None
+        jobs = []
+        for t_index, track in enumerate(self.tracks):
+            if incremental:
+                states[t_index] = self._track_state(track)
+                cached = self._stems.get(track)
+                if cached is not None and cached[0] == states[t_index] and cached[1] == settings:
+                    if verbose:
+                        print(f'\t{Fore.YELLOW}> {t_index+1}/{len(self.tracks)} - Reusing stem: {Style.BRIGHT}{track.name}')
+                    stems[t_index] = cached[2]
+                    if stems_filename is not None:
+                        stem_path = self._stem_path(stems_filename, track)
+                        if not os.path.exists(stem_path):
+                            sf.write(stem_path, stems[t_index], sr, 'PCM_24')
+                    continue
+            stem_path = self._stem_path(stems_filename, track, verbose) if stems_filename is not None else None
+            jobs.append((t_index, (track, events[t_index], seq_len_samples, sr, self.resample_cache, stem_path, self.dtype, self.effect_block_size, segments)))
+
+        # Create and store stems for each track as waveform data
+        if workers is None:
+            for t_index, job in jobs:
                 if verbose:
-                    print(f'\t\t{Fore.LIGHTYELLOW_EX}> Creating stem: {stem_path}')
-                sf.write(stem_path, wav_canvas, sr, 'PCM_24')
+                    print(f'\t{Fore.YELLOW}> {t_index+1}/{len(self.tracks)} - Rendering track: {Style.BRIGHT}{job[0].name}')
+                stems[t_index] = render_track(*job, profiler=profiler)
+        else:
+            if executor == 'thread':
+                pool = ThreadPoolExecutor(max_workers=workers)
+            elif executor == 'process':
+                pool = ProcessPoolExecutor(max_workers=workers)
+                # Workers use the shared cache of their own process, unless the sequence has its own
+                # cache, which is pickled without its buffers so its res_type applies in the workers
+                if self.resample_cache is cache.resample_cache:
+                    jobs = [(t_index, job[:4] + (None,) + job[5:]) for t_index, job in jobs]
+            else:
+                raise ValueError("executor must be 'thread' or 'process'")
+            if verbose:
+                print(f'\t{Fore.YELLOW}> Rendering {len(jobs)} tracks with {workers} {executor} workers')
+            with pool:
+                if executor == 'process' and profiler is not NULL_PROFILER:
+                    # Reports are collected in the workers and merged here
+                    futures = [(t_index, pool.submit(_render_track_profiled, *job)) for t_index, job in jobs]
+                    for t_index, future in futures:
+                        stems[t_index], report = future.result()
+                        profiler.report.merge(report)
+                else:
+                    futures = [(t_index, pool.submit(render_track, *job, profiler=profiler)) for t_index, job in jobs]
+                    for t_index, future in futures:
+                        stems[t_index] = future.result()
 
-            stems.append(wav_canvas)
+        if incremental:
+            for t_index, track in enumerate(self.tracks):
+                self._stems[track] = (states[t_index], settings, stems[t_index])
 
         # Combine stems to single waveform
-        wav_canvas = np.zeros((seq_len_samples, channels),dtype=np.float64)
-        for s_index, stem in enumerate(stems):
-            wav_canvas = np.add(wav_canvas, stem)
+        with profiler.stage('mix', nbytes=canvas_bytes):
+            wav_canvas = np.zeros((seq_len_samples, CHANNELS),dtype=self.dtype)
+            for stem in stems:
+                wav_canvas += stem
 
         # Apply sequence effects
-        for effect in self.effects:
-            if isinstance(effect, VST3Plugin) or isinstance(effect, Pedalboard):
-                wav_canvas = effect.process(wav_canvas, sr)
-            else:
-                wav_canvas = effect.process(wav_canvas)
-        
+        wav_canvas = apply_effects_blocks(self.effects, wav_canvas, sr, self.effect_block_size, profiler, inplace=True)
+
         if normalize_output:
-            wav_canvas = normalize(wav_canvas, max_level=0)
+            with profiler.stage('normalize'):
+                wav_canvas = normalize(wav_canvas, max_level=0, out=wav_canvas)
 
         # Avoid hard clips at start and end of audio
-        wav_canvas = apply_fadeout(wav_canvas,fadeout_duration=0.0001)
-        #wav_canvas = apply_fadein(wav_canvas,fadein_duration=0.001)
+        with profiler.stage('fade'):
+            wav_canvas = apply_fadeout(wav_canvas,fadeout_duration=0.0001)
+            #wav_canvas = apply_fadein(wav_canvas,fadein_duration=0.001)
+
+        return wav_canvas, stems
+
+    def render_stream(
+            self,
+            filename: str = 'render.wav',
+            sr: int = 44100,
+            normalize_output: bool = True,
+            output_stems: bool = False,
+            verbose: bool = True,
+            block_size: int = 65536,
+            max_memory: Optional[int] = None
+        ):
+        """Render sequence to .wav file block by block
+
+        Mixes fixed-size blocks and writes them to disk as it goes, so memory
+        stays flat whatever the length of the sequence (see stream_memory_bound).
+        Effects must be able to process consecutive blocks, which is the case
+        for VST3Plugin/Pedalboard and effects with streams = True (all but
+        Normalize, PitchResample and SoftClip with auto_gain).
+        When normalizing, blocks are first written to a temporary float file
+        next to the output, which is then scaled into the final file.
+
+        Args:
+            filename (str): Path to new audio file
+            sr (int): Sample rate
+            normalize (bool): If audio is to be normalized at the end
+            output_stems (bool): Save track stems alongside new file
+            block_size (int): Number of samples mixed at a time
+            max_memory (int): Peak memory of mixing buffers in bytes, overrides block_size
+        """
+        if max_memory is not None:
+            block_size = max_memory // stream_memory_bound(1, self.dtype)
+        if block_size < 1:
+            raise ValueError('block_size must be at least 1 sample')
+
+        if verbose:
+            print(f'{Fore.CYAN}> Streaming sequence {Style.BRIGHT}{filename}')
+
+        # Make sure every effect can be streamed before writing anything
+        for effect in self.effects + [e for track in self.tracks for e in track.effects]:
+            if not _can_stream(effect):
+                raise ValueError(f'{type(effect).__name__} cannot process audio in blocks')
+            _reset(effect)
+
+        events, seq_len_samples = self.compile_events(sr)
+        track_layers = [
+            [Layer(events[t_index], sample, self.resample_cache, track.monophonic, seq_len_samples, sr, self.dtype) for sample in track.samples]
+            for t_index, track in enumerate(self.tracks)
+        ]
+
+        # The last block absorbs the remainder so it is never shorter than block_size
+        n_blocks = max(seq_len_samples // block_size, 1)
+        offsets = [i * block_size for i in range(n_blocks)] + [seq_len_samples]
+
+        stem_files = []
+        if output_stems:
+            for track in self.tracks:
+                stem_path = self._stem_path(filename, track, verbose)
+                stem_files.append(sf.SoundFile(stem_path, 'w', sr, CHANNELS, 'PCM_24'))
+
+        # Mix to a temporary file until we know the peak level
+        if normalize_output:
+            tmp = tempfile.NamedTemporaryFile(suffix='.wav', dir=os.path.dirname(os.path.abspath(filename)), delete=False)
+            tmp.close()
+            out = sf.SoundFile(tmp.name, 'w', sr, CHANNELS, 'DOUBLE')
+        else:
+            out = sf.SoundFile(filename, 'w', sr, CHANNELS, 'PCM_24')
+
+        # Effects with latency drop the first samples they process, so every track is mixed
+        # ahead of the output by the latency of its effects and of the sequence effects
+        master_latency = chain_latency(self.effects, sr)
+        leads = [chain_latency(track.effects, sr) + master_latency for track in self.tracks]
+        lead = max(leads, default=0)
+        stem_len = 0
+
+        peak = 0.0
+        try:
+            for b_index in range(n_blocks):
+                offset, block_len = offsets[b_index], offsets[b_index+1] - offsets[b_index]
+                # The first block also runs the tracks through their latency, the master through its own
+                master_len = block_len + master_latency if b_index == 0 else block_len
+                master = np.zeros((master_len, CHANNELS), dtype=self.dtype)
+                self._set_sidechain_keys(lambda index: track_layers[index], block_len + lead, offset)
+
+                for t_index, track in enumerate(self.tracks):
+                    if b_index == 0:
+                        start, length = 0, block_len + leads[t_index]
+                    else:
+                        start, length = offset + leads[t_index], block_len
+                    block = mix_layers(track_layers[t_index], np.zeros((length, CHANNELS), dtype=self.dtype), start)
+                    block = apply_effects(track.effects, block, sr, stream=True, inplace=True)
+                    block = adjust_volume(block, track.vol, out=block)
+                    # Past the end of the sequence, tracks only flush the latency of the sequence effects.
+                    # Stems end with the sequence in render(), so tails (eg. of a filter) are cut there too
+                    block[seq_len_samples - stem_len:] = 0
+                    if output_stems:
+                        stem_files[t_index].write(block[:seq_len_samples - stem_len])
+                    master += block
+                stem_len = min(stem_len + master_len, seq_len_samples)
+
+                master = apply_effects(self.effects, master, sr, stream=True, inplace=True)
+
+                if normalize_output:
+                    peak = max(peak, np.max(np.abs(master)))
+                elif b_index == n_blocks - 1:
+                    master = apply_fadeout(master, fadeout_duration=0.0001)
+                out.write(master)
+
+            out.close()
+
+            # Scale the temporary file into the final file
+            if normalize_output:
+                max_level = db_to_linear(0)
+                with sf.SoundFile(tmp.name) as mix, sf.SoundFile(filename, 'w', sr, CHANNELS, 'PCM_24') as out:
+                    for b_index in range(n_blocks):
+                        block = mix.read(offsets[b_index+1] - offsets[b_index], dtype=self.dtype.name)
+                        block = block / peak * max_level
+                        if b_index == n_blocks - 1:
+                            block = apply_fadeout(block, fadeout_duration=0.0001)
+                        out.write(block)
+        finally:
+            out.close()
+            for stem_file in stem_files:
+                stem_file.close()
+            if normalize_output:
+                os.remove(tmp.name)
 
-        # Save audio to .wav file using soundfile
-        sf.write(filename, wav_canvas, sr, 'PCM_24')
         if verbose:
             print(f'{Fore.GREEN}✅ Render complete, file saved as {Fore.LIGHTGREEN_EX}{Style.BRIGHT}{filename}\n')
 
+    def _stem_path(self, filename: str, track: Track, verbose: bool = False) -> str:
+        """Returns the path of a track stem, creating the stems folder if needed"""
+        filename_path = os.path.dirname(filename)
+        filename_base = os.path.splitext(os.path.basename(filename))[0]
+        if not os.path.exists(os.path.join(filename_path, filename_base)):
+            os.mkdir(os.path.join(filename_path, filename_base))
+        stem_path = os.path.join(filename_path, filename_base, f'{filename_base}_{track.name}.wav')
+        if verbose:
+            print(f'\t\t{Fore.LIGHTYELLOW_EX}> Creating stem: {stem_path}')
+        return stem_path
+
     def export_midi(self, path: str = "midi.mid", name_meta: str = "Midi"):
+        if self.arrangement is not None:
+            self.arrangement.export_midi(self.tracks, path, name_meta)
+            return
+        import mido
+
         midi_file = mido.MidiFile()
         midi_tracks = []
         DEFAULT_MIDI_NOTE = 48
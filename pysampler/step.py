@@ -1,12 +1,16 @@
+import hashlib
+
+import numpy as np
+
 class Step:
     def __init__(
-                self, 
-                gate: bool = False, 
-                delay: float = 0.0, 
-                swing: float = 0.0, 
-                humanize: float = 0.0, 
-                vol: float = 0.0, 
-                pitch = 0, 
+                self,
+                gate: bool = False,
+                delay: float = 0.0,
+                swing: float = 0.0,
+                humanize: float = 0.0,
+                vol: float = 0.0,
+                pitch = 0,
                 vel: int = 127
             ) -> None:
         self.gate = gate
@@ -15,4 +19,166 @@ class Step:
         self.humanize = humanize
         self.vel = vel
         self.vol = vol
-        self.pitch = pitch
\ No newline at end of file
+        self.pitch = pitch
+
+# Column name, dtype and default value for every Step attribute
+STEP_FIELDS = {
+    'gate': (np.bool_, False),
+    'delay': (np.float64, 0.0),
+    'swing': (np.float64, 0.0),
+    'humanize': (np.float64, 0.0),
+    'vel': (np.int64, 127),
+    'vol': (np.float64, 0.0),
+    'pitch': (np.float64, 0),
+}
+
+class StepView:
+    """Step-like view of a single row in a StepStore
+    Reading or setting attributes reads or writes the underlying columns"""
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'StepStore', index: int) -> None:
+        self._store = store
+        self._index = index
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in STEP_FIELDS)
+        return f'StepView({values})'
+
+def _field_property(name: str) -> property:
+    def getter(self):
+        return self._store._columns[name][self._index].item()
+    def setter(self, value):
+        self._store._columns[name][self._index] = value
+    return property(getter, setter)
+
+for _name in STEP_FIELDS:
+    setattr(StepView, _name, _field_property(_name))
+
+class StepStore:
+    """Array backed storage for the steps of a Track
+
+    Every Step attribute is stored as a NumPy column (gate, delay, swing,
+    humanize, vel, vol, pitch), available as attributes of the same name.
+    Iterating or indexing yields StepView objects which behave like Step,
+    slicing and multiplying yield new stores, like a list of steps would.
+    """
+
+    def __init__(self, steps = ()) -> None:
+        self._n = 0
+        self._columns = {name: np.zeros(0, dtype=dtype) for name, (dtype, _) in STEP_FIELDS.items()}
+        self.extend(steps)
+
+    @classmethod
+    def from_columns(cls, n: int, **columns) -> 'StepStore':
+        """Create a store of n steps, unspecified columns are set to their defaults"""
+        store = cls()
+        store._reserve(n)
+        for name, (dtype, default) in STEP_FIELDS.items():
+            store._columns[name][:n] = columns.get(name, default)
+        store._n = n
+        return store
+
+    def _reserve(self, n: int) -> None:
+        """Make room for at least n steps, growing columns geometrically"""
+        capacity = len(self._columns['gate'])
+        if n <= capacity:
+            return
+        capacity = max(n, capacity * 2, 16)
+        for name, column in self._columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._n] = column[:self._n]
+            self._columns[name] = grown
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        # Columns are exposed as views trimmed to the number of steps
+        if name in STEP_FIELDS:
+            return self.__dict__['_columns'][name][:self.__dict__['_n']]
+        raise AttributeError(name)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield StepView(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return StepStore.from_columns(
+                len(range(*index.indices(self._n))),
+                **{name: getattr(self, name)[index] for name in STEP_FIELDS}
+            )
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError('step index out of range')
+        return StepView(self, index)
+
+    def __setitem__(self, index: int, step) -> None:
+        view = self[index]
+        for name in STEP_FIELDS:
+            setattr(view, name, getattr(step, name))
+
+    def __mul__(self, n: int) -> 'StepStore':
+        return self.tiled(n)
+
+    def __imul__(self, n: int) -> 'StepStore':
+        self.tile(n)
+        return self
+
+    def __add__(self, other) -> 'StepStore':
+        store = self.copy()
+        store.extend(other)
+        return store
+
+    def __repr__(self) -> str:
+        return f'StepStore({self._n} steps)'
+
+    def copy(self) -> 'StepStore':
+        return self[:]
+
+    def append(self, step) -> None:
+        """Append a Step (or any object with Step attributes)"""
+        self._reserve(self._n + 1)
+        for name in STEP_FIELDS:
+            self._columns[name][self._n] = getattr(step, name)
+        self._n += 1
+
+    def extend(self, steps) -> None:
+        """Append steps from another StepStore or an iterable of Steps"""
+        if not isinstance(steps, StepStore):
+            steps = list(steps)
+            if not steps:
+                return
+            steps = StepStore.from_columns(
+                len(steps),
+                **{name: [getattr(step, name) for step in steps] for name in STEP_FIELDS}
+            )
+        n = len(steps)
+        self._reserve(self._n + n)
+        for name in STEP_FIELDS:
+            self._columns[name][self._n : self._n + n] = getattr(steps, name)
+        self._n += n
+
+    def tiled(self, n: int) -> 'StepStore':
+        """Returns a new store with all steps repeated n times"""
+        return StepStore.from_columns(
+            self._n * max(n, 0),
+            **{name: np.tile(getattr(self, name), max(n, 0)) for name in STEP_FIELDS}
+        )
+
+    def tile(self, n: int) -> None:
+        """Repeat all steps n times in place"""
+        tiled = self.tiled(n)
+        self._columns = tiled._columns
+        self._n = tiled._n
+
+    def digest(self) -> str:
+        """Stable hash of all columns, changes whenever any step does"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(self._n).encode())
+        for name in STEP_FIELDS:
+            h.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        return h.hexdigest()
@@ -1,14 +1,15 @@
-from .step import Step
+from .step import Step, StepStore
 from .sample import Sample
+from .util import params_digest
 import random
-from copy import deepcopy
+import numpy as np
 
 class Track:
     """Track class which contains steps (gates), groove and volume information"""
 
     def __init__(self, name: str = 'default') -> None:
         # TODO: Move Step 'delay' to Track 'delay' - not needed when we have swing and humanize
-        self.steps: list[Step] = []
+        self.steps = StepStore()
         self.name = name
         self.vol = 0
         self.monophonic = False
@@ -16,10 +17,39 @@ class Track:
         self.effects = []
         self.samples: list[Sample] = [] # store Sample objects here
         self.midi_note = None
+        self.revision = 0 # Incremented by mark_dirty()
+
+    @property
+    def steps(self) -> StepStore:
+        """Array backed steps, assigning a list of Step objects converts it"""
+        return self._steps
+
+    @steps.setter
+    def steps(self, steps) -> None:
+        if not isinstance(steps, StepStore):
+            steps = StepStore(steps)
+        self._steps = steps
+
+    def mark_dirty(self) -> None:
+        """Force the track to be rendered again by Sequencer.render(incremental=True)
+        Needed after changes which state() can not see, like VST parameters"""
+        self.revision += 1
+
+    def state(self) -> dict:
+        """Snapshot of everything that affects the rendered stem of this track
+        Two equal states render to the same stem"""
+        return {
+            'steps': self.steps.digest(),
+            'samples': tuple((sample.key, sample.mode, sample.vol, sample.pitch) for sample in self.samples),
+            'effects': tuple(effect_state(effect) for effect in self.effects),
+            'vol': self.vol,
+            'pitch': self.pitch,
+            'monophonic': self.monophonic,
+            'revision': self.revision
+        }
 
     def randomize_velocities(self, min: int = 0, max: int = 127):
-        for step in self.steps:
-            step.vel = random.randint(min, max)
+        self.steps.vel[:] = [random.randint(min, max) for _ in range(len(self.steps))]
 
     def humanize_steps(self, amount: float = 0, n_steps: int = 0, pos_delay: bool = False) -> None: 
         """
@@ -39,26 +69,20 @@ class Track:
             #random_shifts = [random.uniform(0,amount)-amount/2 for _ in range(n_steps)]
             random_shifts = [random.uniform(-amount,amount)/2 for _ in range(n_steps)]
 
-        # Set the humanize parameter for all steps
-        for index, step in enumerate(self.steps):
-            # Ensure positve delay on 1st step to avoid negative time index
-            if index == 0:
-                if random_shifts[index%len(random_shifts)] < 0:
-                    step.humanize = 0
-                else:
-                    step.humanize = random_shifts[index%len(random_shifts)]
-            else:
-                step.humanize = random_shifts[index%len(random_shifts)]
+        # Set the humanize parameter for all steps, repeating every n_steps
+        humanize = self.steps.humanize
+        humanize[:] = np.resize(random_shifts, len(humanize))
+        # Ensure positve delay on 1st step to avoid negative time index
+        if len(humanize) > 0 and humanize[0] < 0:
+            humanize[0] = 0
 
     def duplicate_time(self, n: int = 1):
-        for _ in range(n):
-            self.steps.extend(deepcopy(self.steps))
-        
+        """Doubles the steps n times"""
+        self.steps.tile(2 ** n)
 
     def set_delay(self, delay: float = 0.0):
         """Shifts steps by a factor of 1 step"""
-        for step in self.steps:
-            step.delay = delay
+        self.steps.delay[:] = delay
 
     def set_swing(
             self, 
@@ -86,13 +110,12 @@ class Track:
             percentage = percentage / 2
 
         mod = int(distance*2)
-        for index, step in enumerate(self.steps):
-            if index % mod == int(distance):
-                if additive:
-                    step.swing += percentage
-                else:
-                    step.swing = percentage
-                step.vel = int(step.vel * vel_factor)
+        swung = np.arange(len(self.steps)) % mod == int(distance)
+        if additive:
+            self.steps.swing[swung] += percentage
+        else:
+            self.steps.swing[swung] = percentage
+        self.steps.vel[swung] = (self.steps.vel[swung] * vel_factor).astype(np.int64)
 
     def add_step(self, gate: int = 1, delay: float = 0.0, swing: float = 0.0, humanize: float = 0.0, vel: int = 127):
         """Add single step to track"""
@@ -131,23 +154,29 @@ class Track:
         if len(gates) != len(velocities):
             raise ValueError("Gates and volumes must be the same length")
 
-        # Add steps
-        for i,gate in enumerate(gates):
-            # Convert 0/1 to True/False if needed
-            gate = bool(gate)
-            self.steps.append(
-                Step(
-                    gate=gate,
-                    delay=delay,
-                    swing=swing,
-                    humanize=humanize,
-                    vel=velocities[i],
-                    pitch=pitches[i]
-                ))
+        # Add steps, converting 0/1 to True/False if needed
+        self.steps.extend(StepStore.from_columns(
+            len(gates),
+            gate=[bool(gate) for gate in gates],
+            delay=delay,
+            swing=swing,
+            humanize=humanize,
+            vel=velocities,
+            pitch=pitches
+        ))
     
     def add_effect(self, effect):
         self.effects.append(effect)
     
-    def add_sample(self, path: str = '', pitch: int = 0, vol: float = 0):
-        sample = Sample(path,pitch,vol)
-        self.samples.append(sample)
\ No newline at end of file
+    def add_sample(self, path: str = '', pitch: int = 0, vol: float = 0, mode: str = 'memory'):
+        sample = Sample(path,pitch,vol,mode)
+        self.samples.append(sample)
+
+def effect_state(effect) -> tuple:
+    """Effect type and public parameters, or its identity for effects without
+    Python attributes (VSTs), whose parameter changes can not be detected"""
+    try:
+        params = vars(effect)
+    except TypeError:
+        return (type(effect).__name__, id(effect))
+    return (type(effect).__name__, params_digest(params))
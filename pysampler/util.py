@@ -1,4 +1,9 @@
 import math
+import functools
+import hashlib
+import importlib.util
+
+import numpy as np
 
 def db_to_linear(n):
     """Converts decibel value to linear"""
@@ -6,4 +11,71 @@ def db_to_linear(n):
 
 def linear_to_db(n):
     """Converts linear value to decibel"""
-    return math.log10(abs(n)) * 20
\ No newline at end of file
+    return math.log10(abs(n)) * 20
+
+def has_module(name: str) -> bool:
+    """Whether a module is installed, without importing it"""
+    return importlib.util.find_spec(name) is not None
+
+def params_digest(params: dict) -> str:
+    """Stable hash of effect parameters, public ones only
+
+    Arrays are hashed by content, their repr elides everything but the
+    first and last few values of large arrays.
+    """
+    h = hashlib.sha256()
+    _hash_value(h, {k: v for k, v in params.items() if not k.startswith('_')})
+    return h.hexdigest()
+
+def _hash_value(h, value) -> None:
+    if isinstance(value, np.ndarray):
+        h.update(repr(('ndarray', value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(b'dict')
+        for key in sorted(value, key=repr):
+            _hash_value(h, key)
+            _hash_value(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _hash_value(h, item)
+    elif isinstance(value, (set, frozenset)):
+        h.update(f'set{len(value)}'.encode())
+        for item in sorted(value, key=repr):
+            _hash_value(h, item)
+    else:
+        h.update(repr(value).encode())
+    h.update(b';')
+
+def lazy_jit(func):
+    """numba.njit(cache=True, nogil=True), applied on the first call
+    so numba is only imported by code that uses it"""
+    compiled = None
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        nonlocal compiled
+        if compiled is None:
+            import numba
+            compiled = numba.njit(cache=True, nogil=True)(func)
+        return compiled(*args)
+    return wrapper
+
+@functools.lru_cache(maxsize=None)
+def _colorama():
+    import colorama
+    colorama.init(autoreset=True)
+    return colorama
+
+class LazyColorama:
+    """Stands in for colorama.Fore or colorama.Style, importing colorama when a color is first printed"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __getattr__(self, attr: str) -> str:
+        return getattr(getattr(_colorama(), self.name), attr)
+
+Fore = LazyColorama('Fore')
+Style = LazyColorama('Style')